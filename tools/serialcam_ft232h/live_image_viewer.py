@@ -4,8 +4,13 @@
 Live Image Viewer
 
 - Normal mode: matplotlib GUI with vmin/vmax, colormap radios, dtype radios.
+  8/16-bit data is colorized through a cached RGBA lookup table (one entry per
+  possible sample value) built for the current interpretation, cmap and range.
 - Fast mode: OpenCV window, jet colormap, uint8 input, pvmin=38, pvmax=141,
   colorbar labeled 0.3–1.1, and "NaN" semantics via value 0 -> white.
+- Qt mode (backend="qt"): same colorization as normal mode, but the RGBA frame
+  is wrapped in a QImage without copying and painted by a plain QWidget
+  (keys: c = next colormap, d = int/float16-view, r = autoscale once).
 """
 
 from typing import Optional, Tuple
@@ -13,6 +18,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.widgets import TextBox, RadioButtons
 from matplotlib.colors import Normalize
+from matplotlib.cm import ScalarMappable
 import cv2
 
 
@@ -29,7 +35,13 @@ class LiveImageViewer:
         fast: bool = False,
         interpolation: str = "nearest",
         blit: bool = False,            # accepted but ignored (we disable blitting)
+        backend: Optional[str] = None,  # "matplotlib" | "cv2" | "qt", default from fast
     ):
+        if backend is None:
+            backend = "cv2" if fast else "matplotlib"
+        if backend not in ("matplotlib", "cv2", "qt"):
+            raise ValueError(f"Unknown backend: {backend}")
+
         # --- initial data/state ---
         self._raw = np.zeros(shape, dtype=dtype)
         self._interpretation = interpretation
@@ -37,8 +49,10 @@ class LiveImageViewer:
         self._vmin = vmin
         self._vmax = vmax
         self._interpolation = interpolation
-        self._fast = fast
+        self._fast = backend == "cv2"
+        self._qt = backend == "qt"
         self._needs_cbar_refresh = True
+        self._cmap_options = ["gray", "viridis", "magma", "plasma", "inferno", "jet"]
 
         # No blitting: keep flags for API compatibility, but never use them
         self._blit = False
@@ -51,6 +65,11 @@ class LiveImageViewer:
         # Normalize object (used only in matplotlib mode)
         self._norm: Optional[Normalize] = None
 
+        # RGBA lookup tables (matplotlib mode), by (interpretation, dtype, cmap, vmin, vmax)
+        self._luts = {}
+        self._rgba: Optional[np.ndarray] = None   # reused colorized frame
+        self._cbar_mappable: Optional[ScalarMappable] = None
+
         # Common attributes
         self.fig = None
         self.ax_img = None
@@ -62,6 +81,12 @@ class LiveImageViewer:
         self._cbar_img: Optional[np.ndarray] = None
         self._pvmin: Optional[int] = None
         self._pvmax: Optional[int] = None
+        self._cv2_lut: Optional[np.ndarray] = None   # 256-entry BGR lookup table
+        self._cv2_lut_key = None                     # (pvmin, pvmax) it was built for
+        self._cv2_out: Optional[np.ndarray] = None   # reused output frame
+
+        # Qt mode specific
+        self._qt_view = None
 
         if self._fast:
             # --------- FAST MODE: OpenCV viewer ---------
@@ -85,10 +110,18 @@ class LiveImageViewer:
 
             return
 
-        # --------- NORMAL (FULL UI) MODE: matplotlib ---------
-        # Fixed normalization for this mode
+        # Fixed normalization (matplotlib and Qt modes)
         self._norm = Normalize(vmin=self._vmin, vmax=self._vmax, clip=True)
 
+        if self._qt:
+            # --------- QT MODE: QImage over the colorized frame ---------
+            from qt_image_view import QtImageView
+            self._qt_view = QtImageView(title=title, on_key=self._handle_key)
+            self._render()
+            return
+
+        # --------- NORMAL (FULL UI) MODE: matplotlib ---------
+
         # --- figure/layout ---
         self.fig = plt.figure(figsize=(12, 8.5), constrained_layout=True)
         mgr = getattr(self.fig.canvas, "manager", None)
@@ -117,10 +150,14 @@ class LiveImageViewer:
             aspect="equal",
         )
 
-        # Colorbar created once; refresh only on user changes
+        # Colorbar created once; refresh only on user changes. It has its own
+        # mappable since the image usually holds already colorized RGBA data.
+        self._cbar_mappable = ScalarMappable(norm=self._norm, cmap=self._cmap)
+        self._cbar_mappable.set_array(img)
         self.cbar = self.fig.colorbar(
-            self.im, ax=self.ax_img, shrink=0.95, pad=0.01, fraction=0.02
+            self._cbar_mappable, ax=self.ax_img, shrink=0.95, pad=0.01, fraction=0.02
         )
+        self._render()
 
         # Right: stacked controls
         control_gs = outer[0, 1].subgridspec(
@@ -156,7 +193,6 @@ class LiveImageViewer:
         # Colormap radios
         self.ax_cmap = self.fig.add_subplot(control_gs[4, 0])
         self.ax_cmap.set_title("Colormap", fontsize=9, pad=6)
-        self._cmap_options = ["gray", "viridis", "magma", "plasma", "inferno", "jet"]
         active_idx = self._cmap_options.index(self._cmap) if self._cmap in self._cmap_options else 0
         self.rb_cmap = RadioButtons(self.ax_cmap, labels=self._cmap_options, active=active_idx)
         self.rb_cmap.on_clicked(self._on_cmap_clicked)
@@ -179,15 +215,19 @@ class LiveImageViewer:
         if self._fast:
             # In cv2 mode, there's no blocking show; caller should use cv2.waitKey().
             return
+        if self._qt:
+            # Qt mode: the caller runs the Qt event loop
+            self._qt_view.show()
+            return
         plt.show(block=block)
 
     def update_image(self, array: np.ndarray, *, interpretation: Optional[str] = None,
                      vmin: Optional[float] = None, vmax: Optional[float] = None,
                      cmap: Optional[str] = None) -> None:
-        # Convert reference; caller can ensure contiguity upstream if needed
-        self._raw = np.asarray(array)
+        array = np.asarray(array)
 
         if self._fast:
+            self._raw = array
             # --------- FAST CV2 PATH ---------
             frame_color = self._cv2_prepare_frame(self._raw)
             cv2.imshow(self._win_name, frame_color)
@@ -196,7 +236,14 @@ class LiveImageViewer:
             # NOTE: caller (e.g., demo) should call cv2.waitKey(1) per frame
             return
 
-        # --------- NORMAL MATPLOTLIB PATH ---------
+        # --------- NORMAL MATPLOTLIB / QT PATH ---------
+        # Keep our own copy (the caller may reuse its buffer once we return),
+        # reusing the previous one when the shape and dtype did not change
+        if self._raw.shape == array.shape and self._raw.dtype == array.dtype:
+            np.copyto(self._raw, array)
+        else:
+            self._raw = np.array(array, copy=True)
+
         if interpretation is not None and interpretation != self._interpretation:
             self._interpretation = interpretation
 
@@ -219,15 +266,8 @@ class LiveImageViewer:
                 if idx != self.rb_cmap.active:
                     self.rb_cmap.set_active(idx)
 
-        # Set new pixels (no autoscale)
-        img = self._coerce_view(self._raw, self._interpretation)
-        if self.im is not None:
-            self.im.set_data(img)
-
-        # Only refresh colorbar when needed (constant cost otherwise)
-        if self._needs_cbar_refresh and self.cbar is not None:
-            self.cbar.update_normal(self.im)
-            self._needs_cbar_refresh = False
+        # Set new pixels (no autoscale), the colorbar is only refreshed when needed
+        self._render()
 
         # Single draw path (no blitting)
         if self.fig is not None:
@@ -250,6 +290,8 @@ class LiveImageViewer:
         if hasattr(self, "tb_vmax"):
             self.tb_vmax.set_val("" if vmax is None else str(vmax))
 
+        # colors are baked into the RGBA frame, recolorize it
+        self._render()
         if self.fig is not None:
             self.fig.canvas.draw_idle()
 
@@ -257,11 +299,14 @@ class LiveImageViewer:
         if cmap == self._cmap:
             return
         self._cmap = cmap
-        if not self._fast and self.im is not None:
+        if self._fast:
+            return
+        if self.im is not None:
             self.im.set_cmap(cmap)
-            self._needs_cbar_refresh = True
-            if self.fig is not None:
-                self.fig.canvas.draw_idle()
+        self._needs_cbar_refresh = True
+        self._render()
+        if self.fig is not None:
+            self.fig.canvas.draw_idle()
 
     def set_interpretation(self, interpretation: str) -> None:
         if interpretation not in ("int", "float16-view", "byte-decimal-view"):
@@ -285,13 +330,7 @@ class LiveImageViewer:
             self._updating_dtype = False
 
         # Re-render image with new interpretation (no autoscan)
-        img = self._coerce_view(self._raw, self._interpretation)
-        if self.im is not None:
-            self.im.set_data(img)
-
-        if self._needs_cbar_refresh and self.cbar is not None:
-            self.cbar.update_normal(self.im)
-            self._needs_cbar_refresh = False
+        self._render()
 
         if self.fig is not None:
             self.fig.canvas.draw_idle()
@@ -303,8 +342,19 @@ class LiveImageViewer:
         if a.dtype != np.uint8:
             a = a.astype(np.uint8)
 
-        # "NaN" semantics: raw value 0 is considered invalid → white
-        nan_mask = (a == 0)
+        # The whole mapping (normalization, jet colormap, 0 -> white) is a
+        # 256-entry BGR table, a frame is a single gather into a reused buffer
+        lut = self._cv2_get_lut()
+        if self._cv2_out is None or self._cv2_out.shape[:2] != a.shape:
+            self._cv2_out = np.empty(a.shape + (3,), dtype=np.uint8)
+        np.take(lut, a, axis=0, out=self._cv2_out)
+        return self._cv2_out
+
+    def _cv2_get_lut(self) -> np.ndarray:
+        # Rebuilt only when the pixel-domain range changes
+        key = (self._pvmin, self._pvmax)
+        if self._cv2_lut is not None and self._cv2_lut_key == key:
+            return self._cv2_lut
 
         pvmin = self._pvmin
         pvmax = self._pvmax
@@ -312,27 +362,24 @@ class LiveImageViewer:
             # Fallback: use full range if somehow unset
             pvmin, pvmax = 0, 255
 
-        # Convert to float for normalization
-        val = a.astype(np.float32)
-
+        val = np.arange(256, dtype=np.float32)
         # For "invalid" pixels (0), pretend they are at pvmin for colormap
-        val[nan_mask] = float(pvmin)
+        val[0] = float(pvmin)
 
         # Normalize to [0,1] based on pixel-domain vmin/vmax
         norm = (val - float(pvmin)) / float(pvmax - pvmin)
         norm = np.clip(norm, 0.0, 1.0)
 
-        # Convert to 8-bit index for colormap
-        img8 = (norm * 255.0).astype(np.uint8)
+        # Convert to 8-bit index for the jet colormap
+        img8 = (norm * 255.0).astype(np.uint8).reshape(256, 1)
+        lut = cv2.applyColorMap(img8, cv2.COLORMAP_JET).reshape(256, 3)
 
-        # Apply jet colormap
-        img_color = cv2.applyColorMap(img8, cv2.COLORMAP_JET)
-
-        # NaN → white (pixels that were 0 in original)
-        if nan_mask.any():
-            img_color[nan_mask] = (255, 255, 255)
+        # "NaN" semantics: raw value 0 is considered invalid → white
+        lut[0] = (255, 255, 255)
 
-        return img_color
+        self._cv2_lut = np.ascontiguousarray(lut)
+        self._cv2_lut_key = key
+        return self._cv2_lut
 
     def _build_cv2_colorbar(self):
         # Build vertical colorbar image using jet colormap
@@ -369,6 +416,113 @@ class LiveImageViewer:
         self._cbar_img = cbar
 
     # ---------- Internals: matplotlib path ----------
+    LUT_CACHE_SIZE = 8
+
+    def _render(self) -> None:
+        # Colorize the current frame through the lookup table when possible,
+        # otherwise let matplotlib normalize and colormap the interpreted values
+        if self._qt:
+            self._qt_render()
+            return
+        if self.im is None:
+            return
+        size = self.im.get_size()
+        rgba = self._lut_render(self._raw)
+        if rgba is not None:
+            self.im.set_data(rgba)
+        else:
+            img = self._coerce_view(self._raw, self._interpretation)
+            self.im.set_data(img)
+            if self._cbar_mappable is not None:
+                self._cbar_mappable.set_array(img)  # for autoscaled (None) limits
+        h, w = self.im.get_size()
+        if (h, w) != size:
+            # the extent is fixed when the image is created, follow new frame sizes
+            self.im.set_extent((-0.5, w - 0.5, h - 0.5, -0.5))
+
+        # Only refresh colorbar when needed (constant cost otherwise)
+        if self._needs_cbar_refresh and self.cbar is not None:
+            self._cbar_mappable.set_cmap(self._cmap)
+            self.cbar.update_normal(self._cbar_mappable)
+            self._needs_cbar_refresh = False
+
+    # ---------- Internals: Qt path ----------
+    def _qt_render(self) -> None:
+        rgba = self._lut_render(self._raw)
+        if rgba is None:
+            # Wider dtypes or autoscaled limits: colorize through matplotlib
+            img = np.ma.masked_invalid(self._coerce_view(self._raw, self._interpretation))
+            norm = Normalize(vmin=self._vmin, vmax=self._vmax, clip=True)
+            norm.autoscale_None(img)
+            rgba = plt.get_cmap(self._cmap)(norm(img), bytes=True)
+            self._needs_cbar_refresh = True  # limits may follow the frame
+        self._qt_view.set_frame(rgba)
+
+        if self._needs_cbar_refresh:
+            vmin = self._vmin if self._vmin is not None else norm.vmin
+            vmax = self._vmax if self._vmax is not None else norm.vmax
+            strip = plt.get_cmap(self._cmap)(np.linspace(1.0, 0.0, 256), bytes=True)
+            self._qt_view.set_colorbar(strip.reshape(256, 1, 4), f"{vmin:g}", f"{vmax:g}")
+            self._needs_cbar_refresh = False
+
+    def _lut_indices(self, arr: np.ndarray) -> Optional[np.ndarray]:
+        # Integer array indexing the lookup table, None if the data is not 8/16-bit
+        a = np.asarray(arr)
+        interpretation = self._interpretation
+        if interpretation == "float16-view":
+            if a.dtype in (np.uint16, np.int16):
+                return a.view(np.uint16)
+            if a.dtype in (np.uint32, np.int32):
+                return (a & 0xFFFF).astype(np.uint16)
+            if a.dtype == np.uint8 and a.ndim == 2 and a.size % 2 == 0:
+                return np.ascontiguousarray(a).view(np.uint16)
+            return None
+        if a.dtype == np.uint8:
+            return a
+        if a.dtype in (np.uint16, np.int16):
+            return a.view(np.uint16)
+        return None
+
+    def _lut_render(self, arr: np.ndarray) -> Optional[np.ndarray]:
+        # One gather from the lookup table into the reused RGBA frame
+        if self._vmin is None or self._vmax is None:
+            return None  # autoscaled limits depend on the frame
+        idx = self._lut_indices(arr)
+        if idx is None:
+            return None
+        lut = self._get_lut(np.asarray(arr).dtype, idx.dtype)
+        if self._rgba is None or self._rgba.shape[:2] != idx.shape:
+            self._rgba = np.empty(idx.shape + (4,), dtype=np.uint8)
+        np.take(lut, idx, axis=0, out=self._rgba)
+        return self._rgba
+
+    def _get_lut(self, dtype: np.dtype, index_dtype: np.dtype) -> np.ndarray:
+        # Built only when the interpretation, cmap or range changes
+        key = (self._interpretation, dtype.str, self._cmap, self._vmin, self._vmax)
+        lut = self._luts.get(key)
+        if lut is not None:
+            return lut
+
+        # every possible sample value, interpreted like _coerce_view does
+        codes = np.arange(np.iinfo(index_dtype).max + 1, dtype=index_dtype)
+        samples = codes.view(np.int16) if dtype == np.int16 else codes
+        if self._interpretation == "float16-view":
+            values = codes.view(np.float16)
+        elif self._interpretation == "byte-decimal-view":
+            values = samples.astype(np.float32) / (2 ** 7)
+            values[samples == 0] = np.nan
+        else:
+            values = samples
+        values = np.ma.masked_invalid(values.astype(np.float64))
+
+        norm = Normalize(vmin=self._vmin, vmax=self._vmax, clip=True)
+        lut = np.ascontiguousarray(plt.get_cmap(self._cmap)(norm(values), bytes=True))
+
+        if len(self._luts) >= self.LUT_CACHE_SIZE:
+            self._luts.pop(next(iter(self._luts)))
+        self._luts[key] = lut
+        return lut
+
     def _coerce_view(self, arr: np.ndarray, interpretation: str) -> np.ndarray:
         a = np.asarray(arr)
         if interpretation == "int":
@@ -384,7 +538,8 @@ class LiveImageViewer:
                     raise TypeError("float16-view expects a 2D array; got shape %r" % (a.shape,))
                 if a.size % 2 != 0:
                     raise ValueError("Total number of bytes must be even to reinterpret as float16.")
-                b = a.view(np.uint16)
+                # reinterpreting pairs of bytes needs them to be adjacent
+                b = np.ascontiguousarray(a).view(np.uint16)
                 return b.view(np.float16)
             raise TypeError(f"Unsupported dtype {a.dtype} for float16-view")
         elif interpretation == "byte-decimal-view":
@@ -400,6 +555,7 @@ class LiveImageViewer:
         if self._norm is not None:
             self._norm.vmin = v
         self._needs_cbar_refresh = True
+        self._render()
         if self.fig is not None:
             self.fig.canvas.draw_idle()
 
@@ -409,6 +565,7 @@ class LiveImageViewer:
         if self._norm is not None:
             self._norm.vmax = v
         self._needs_cbar_refresh = True
+        self._render()
         if self.fig is not None:
             self.fig.canvas.draw_idle()
 
@@ -421,9 +578,6 @@ class LiveImageViewer:
 
     def _on_cmap_clicked(self, label: str) -> None:
         self.set_cmap(label)
-        if self._needs_cbar_refresh and self.cbar is not None:
-            self.cbar.update_normal(self.im)
-            self._needs_cbar_refresh = False
         if self.fig is not None:
             self.fig.canvas.draw_idle()
 
@@ -438,21 +592,23 @@ class LiveImageViewer:
 
     def _on_key(self, event) -> None:
         # Fast (cv2) mode does not bind this
-        if event.key in ("c", "C"):
-            labels = [t.get_text() for t in self.rb_cmap.labels]
+        self._handle_key(event.key)
+
+    def _handle_key(self, key: str) -> None:
+        # Shared by the matplotlib key_press_event and the Qt view
+        if key in ("c", "C"):
+            labels = self._cmap_options
             idx = labels.index(self._cmap) if self._cmap in labels else 0
             idx = (idx + 1) % len(labels)
             self.set_cmap(labels[idx])
-            if self._needs_cbar_refresh and self.cbar is not None:
-                self.cbar.update_normal(self.im)
-                self._needs_cbar_refresh = False
             if self.fig is not None:
                 self.fig.canvas.draw_idle()
-        elif event.key in ("d", "D"):
+        elif key in ("d", "D"):
             self.set_interpretation("float16-view" if self._interpretation == "int" else "int")
-        elif event.key in ("r", "R"):
+        elif key in ("r", "R"):
             # One-time autoscale from current frame, then fix it
-            img = np.asarray(self.im.get_array(), dtype=float)
+            # (the image itself may hold RGBA data, use the interpreted values)
+            img = np.asarray(self._coerce_view(self._raw, self._interpretation), dtype=float)
             finite = np.isfinite(img)
             if finite.any():
                 vmin = float(np.nanmin(img[finite]))
@@ -461,6 +617,7 @@ class LiveImageViewer:
                 if self._norm is not None:
                     self._norm.vmin, self._norm.vmax = vmin, vmax
                 self._needs_cbar_refresh = True
+                self._render()
             if self.fig is not None:
                 self.fig.canvas.draw_idle()
 
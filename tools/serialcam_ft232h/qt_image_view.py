@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Qt image view used by the "qt" backend of LiveImageViewer.
+
+Frames are colorized RGBA arrays; they are wrapped in a QImage without
+copying and painted (scaled, aspect ratio kept, no smoothing) by a plain
+QWidget, next to a colorbar strip labeled with vmin/vmax.
+"""
+
+from typing import Callable, Optional
+import numpy as np
+from PyQt5 import QtWidgets, QtGui, QtCore
+
+
+class QtImageView(QtWidgets.QWidget):
+    COLORBAR_WIDTH = 24
+    MARGIN = 6
+
+    def __init__(self, title: str = "Live Image Viewer", on_key: Optional[Callable[[str], None]] = None,
+                 parent=None):
+        super().__init__(parent)
+        self.setWindowTitle(title)
+        self.resize(960, 820)
+        self.setAttribute(QtCore.Qt.WA_OpaquePaintEvent)
+        self._on_key = on_key
+
+        # The QImages only wrap these arrays, keep them alive while displayed
+        self._frame: Optional[np.ndarray] = None
+        self._image: Optional[QtGui.QImage] = None
+        self._cbar: Optional[np.ndarray] = None
+        self._cbar_image: Optional[QtGui.QImage] = None
+        self._cbar_labels = ("", "")
+        self._title = title
+
+    def set_frame(self, rgba: np.ndarray) -> None:
+        """
+        Shows a (h, w, 4) uint8 RGBA frame. The array is not copied, the
+        caller may only overwrite it from the GUI thread.
+        """
+        rgba = np.ascontiguousarray(rgba)
+        h, w = rgba.shape[:2]
+        if self._frame is not rgba or self._image is None or (self._image.width(), self._image.height()) != (w, h):
+            self._frame = rgba
+            self._image = QtGui.QImage(rgba.data, w, h, w * 4, QtGui.QImage.Format_RGBA8888)
+        self.update()
+
+    def set_colorbar(self, rgba: np.ndarray, vmin: str, vmax: str) -> None:
+        """
+        rgba: (n, 1, 4) uint8 colors from vmax (top) to vmin (bottom).
+        """
+        self._cbar = np.ascontiguousarray(rgba)
+        n = self._cbar.shape[0]
+        self._cbar_image = QtGui.QImage(self._cbar.data, 1, n, 4, QtGui.QImage.Format_RGBA8888)
+        self._cbar_labels = (vmin, vmax)
+        self.update()
+
+    def paintEvent(self, event) -> None:
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), QtCore.Qt.black)
+        label_width = painter.fontMetrics().horizontalAdvance("-0000.00")
+        right = self.COLORBAR_WIDTH + label_width + 3 * self.MARGIN
+        area = self.rect().adjusted(self.MARGIN, self.MARGIN, -right, -self.MARGIN)
+
+        if self._image is not None and area.width() > 0 and area.height() > 0:
+            size = QtCore.QSize(self._image.width(), self._image.height())
+            size.scale(area.size(), QtCore.Qt.KeepAspectRatio)
+            target = QtCore.QRect(area.topLeft(), size)
+            # nearest neighbour scaling, like interpolation="nearest"
+            painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform, False)
+            painter.drawImage(target, self._image)
+
+        if self._cbar_image is not None:
+            bar = QtCore.QRect(area.right() + 2 * self.MARGIN, area.top(), self.COLORBAR_WIDTH, area.height())
+            painter.drawImage(bar, self._cbar_image)
+            painter.setPen(QtCore.Qt.white)
+            vmin, vmax = self._cbar_labels
+            text_x = bar.right() + self.MARGIN
+            painter.drawText(text_x, bar.top() + painter.fontMetrics().ascent(), vmax)
+            painter.drawText(text_x, bar.bottom(), vmin)
+        painter.end()
+
+    def keyPressEvent(self, event) -> None:
+        if self._on_key is not None and event.text():
+            self._on_key(event.text())
+        else:
+            super().keyPressEvent(event)
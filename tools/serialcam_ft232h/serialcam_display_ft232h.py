@@ -0,0 +1,297 @@
+# GUI side of the serialcam tool: the Qt main window and the per channel
+# LiveImageViewer windows (or a single one showing every channel tiled).
+import queue
+import time
+import numpy as np
+from PyQt5 import QtWidgets, QtGui, QtCore
+from serialcam_ft232h_dialogs import *
+from serialcam_stream_utils_ft232h import release_group, display_crop, TileCanvas
+from serialcam_metrics_ft232h import metrics
+from serialcam_recorder_ft232h import trigger_request
+from live_image_viewer import LiveImageViewer
+import matplotlib.pyplot as plt
+plt.ion()
+plt.show(block=False)
+
+# This class displays recieved data in a qt window.
+# Images are passed in through the 'image_queue', one item per frame holding
+# the packages of all its channels (see publish_channels), channels past
+# maxchannels are not shown. The display is refreshed at
+# display_fps (at most), independently of the capture rate; with display_fps=0
+# a redraw is requested by whatever pushes to the image queue through the
+#     window.new_image_received.emit()
+# Signal
+# Either way only the newest complete group of channels is drawn.
+# Register writes go through the 'registers' ShadowRegisterFile (when given),
+# so only the values that changed are sent.
+# The status bar is refreshed a few times per second from a status source
+# (a function returning the text to show), see set_status_source().
+class ImageDisplayWindow(QtWidgets.QMainWindow):
+    new_image_received = QtCore.pyqtSignal()
+    capture_settings: dict = None
+    image_scale: float = 1.0
+    color_map: str = "gray"      # "gray" or "color"
+
+    def __init__(self, maxchannels, image_queue, command_queue, write_command_queue, fast=False, tracer=None, registers=None,
+                 display_fps=30, viewer=None, tiled=False, parent=None):
+        """
+        this window reads numpy arrays from image_queue containing images to display.
+        Commands are sent from 'command_queue' to the different interface threads (the ft232
+        reader thread and image decoder thread) in response to user actions.
+        """
+        super().__init__(parent)
+
+        self.image_queue = image_queue
+        self.command_queue = command_queue
+        self.write_command_queue = write_command_queue
+        self.fast = fast
+        self.tracer = tracer
+        self.registers = registers
+
+        # Make space for image display
+        self.image_display = QtWidgets.QLabel(self)
+        self.setCentralWidget(self.image_display)
+
+        self.maxchannels = maxchannels
+        # channel counts already warned about (more channels than maxchannels)
+        self.unshown_channel_counts = set()
+        if display_fps > 0:
+            # Redraw at a fixed rate, the 'new_image_received' signal is not needed
+            self.present_timer = QtCore.QTimer(self)
+            self.present_timer.timeout.connect(self.update_image)
+            self.present_timer.start(max(1, int(1000 / display_fps)))
+        else:
+            # Trigger an update image whenever the 'new_image_received' signal is fired.
+            self.new_image_received.connect(self.update_image)
+
+        # Add menus for image capture
+        self._add_menu()
+
+        # Add a status bar for showing frame rate and image stats
+        self.status = QtWidgets.QStatusBar()
+        monospace_font = QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont)
+        self.status.setFont(monospace_font)
+        self.setStatusBar(self.status)
+        self.status_source = None
+        self.status_timer = QtCore.QTimer(self)
+        self.status_timer.timeout.connect(self.refresh_status)
+        self.status_timer.start(250)
+
+        self.frames_meter = metrics.meter("display.frames")
+        self.draw_timer   = metrics.timer("display.draw_time")
+        self.skipped_meter = metrics.meter("display.skipped")
+
+        # Matplotlib windows
+        self.mp_windows = []
+        self.tiles = None
+        if tiled:
+            # One viewer for all channels, drawn from a persistent canvas
+            self.tiles = TileCanvas()
+            rows, cols = display_crop(self.fast)
+            self.tiles.layout(maxchannels, (rows.stop - rows.start, cols.stop - cols.start), np.uint16)
+            self.mp_windows.append(LiveImageViewer(shape=self.tiles.canvas.shape, cmap="gray", vmin=0, vmax=255,
+                                                   title="Channels", fast=self.fast, backend=viewer))
+        else:
+            for c in range(maxchannels):
+                self.mp_windows.append(LiveImageViewer(cmap="gray", vmin=0, vmax=255, title=("Channel "+str(c)), fast=self.fast,
+                                                       backend=viewer))
+        if viewer == "qt":
+            # Qt viewers live in this event loop, no matplotlib figure involved
+            for w in self.mp_windows:
+                w.show()
+        else:
+            plt.show(block=False)
+
+    def set_status_source(self, status_source):
+        self.status_source = status_source
+
+    def refresh_status(self):
+        if self.status_source is not None:
+            self.status.showMessage(self.status_source())
+
+    def update_image(self):
+        # Presentation scheduler: every channel group queued so far is
+        # taken, only the newest is drawn and the older ones are given back to
+        # the pool without being drawn (counted in display.skipped).
+        # image queue
+        # element : [ [header_info, image_data, frame_buffer], [header_info, image_data, frame_buffer], ...]
+        newest = None
+        while True:
+            try:
+                rx_channel_pkgs = self.image_queue.get_nowait()
+            except queue.Empty:
+                break
+            if newest is not None:
+                self.skipped_meter.mark()
+                release_group(newest)
+            newest = rx_channel_pkgs
+        if not newest:
+            return  # nothing queued (or a frame without channels)
+        shown = self.shown_channels(newest)
+
+        start = time.perf_counter()
+        if self.tiles is not None:
+            self.mp_windows[0].update_image(self.tiles.update([pkg[1] for pkg in shown]))
+        else:
+            for c, pkg in enumerate(shown):
+                self.mp_windows[c].update_image(pkg[1])
+        self.draw_timer.observe(time.perf_counter() - start)
+        self.frames_meter.mark()
+
+        if self.tracer is not None:
+            self.tracer.finish(getattr(newest[0][2], "trace", None))
+
+        # the viewers keep their own copy, give the buffers back to the pool
+        release_group(newest)
+
+        #plt.pause(0.001)
+
+    def shown_channels(self, rx_channel_pkgs):
+        """
+        Returns the packages of the channels that have a viewer, warns once
+        per channel count when a frame has more channels than maxchannels.
+        """
+        channels = len(rx_channel_pkgs)
+        if channels > self.maxchannels and channels not in self.unshown_channel_counts:
+            self.unshown_channel_counts.add(channels)
+            print(f"Frames have {channels} channels, only the first {self.maxchannels} are displayed "
+                  f"(see --maxchannels)")
+        return rx_channel_pkgs[:self.maxchannels]
+
+    def _add_menu(self):
+        # File menu
+        menubar = self.menuBar()
+        file_menu = menubar.addMenu("&File")
+        capture_action = QtWidgets.QAction("Capture", self)
+        capture_action.triggered.connect(self.open_capture_dialog)
+        file_menu.addAction(capture_action)
+        trigger_action = QtWidgets.QAction("Trigger Capture", self)
+        trigger_action.setShortcut("Ctrl+T")
+        trigger_action.triggered.connect(self.trigger_capture)
+        file_menu.addAction(trigger_action)
+        if self.command_queue is None:
+            # nothing records the frames (e.g. multi-board captures)
+            for action in (capture_action, trigger_action):
+                action.setEnabled(False)
+                action.setToolTip("Capture is not supported with several boards")
+
+        # View menu
+        view_menu = menubar.addMenu("&View")
+        view_options_action = QtWidgets.QAction("View Options", self)
+        view_options_action.triggered.connect(self.open_view_options_dialog)
+        view_menu.addAction(view_options_action)
+
+        # Send command menu
+        command_menu = menubar.addMenu("&Command")
+
+        # Send raw command
+        command_action = QtWidgets.QAction("Send Command", self)
+        command_action.triggered.connect(self.open_command_dialog)
+        command_menu.addAction(command_action)
+
+        # Set homography
+        set_camera_0_homography_action = QtWidgets.QAction("Set Camera 0 Homography", self)
+        set_camera_0_homography_action.triggered.connect(lambda: self.open_camera_homography_dialog(0x20))
+        command_menu.addAction(set_camera_0_homography_action)
+        set_camera_1_homography_action = QtWidgets.QAction("Set Camera 1 Homography", self)
+        set_camera_1_homography_action.triggered.connect(lambda: self.open_camera_homography_dialog(0x10))
+        command_menu.addAction(set_camera_1_homography_action)
+
+        # Set ROI
+        roi_action = QtWidgets.QAction("Send Roi", self)
+        roi_action.triggered.connect(self.open_roi_dialog)
+        command_menu.addAction(roi_action)
+
+        # Set DfDD parameters
+        set_params_action = QtWidgets.QAction("Set DfDD Parameters", self)
+        set_params_action.triggered.connect(self.open_dfdd_parameters_dialog)
+        command_menu.addAction(set_params_action)
+
+        # Register shadow
+        command_menu.addSeparator()
+        replay_registers_action = QtWidgets.QAction("Replay All Registers (after FPGA reset)", self)
+        replay_registers_action.triggered.connect(self.replay_registers)
+        command_menu.addAction(replay_registers_action)
+        forget_registers_action = QtWidgets.QAction("Forget Register State", self)
+        forget_registers_action.triggered.connect(self.forget_registers)
+        command_menu.addAction(forget_registers_action)
+
+    def open_capture_dialog(self):
+        dialog = CaptureDialog(settings=self.capture_settings)
+        if dialog.exec_() == QtWidgets.QDialog.Accepted:
+            values = dialog.get_values()
+            self.capture_settings = values
+            print("\nCapture request:", values)
+            if(self.command_queue is None):
+                print("Request ignored, not central channel")
+            else:
+                self.command_queue.put(values)
+
+
+    def trigger_capture(self):
+        # the frames around the trigger are written by the pre-trigger ring
+        # of the StreamDecoder (--pretrigger_s)
+        if(self.command_queue is None):
+            print("Trigger ignored, not central channel")
+        else:
+            self.command_queue.put(trigger_request())
+
+    def open_view_options_dialog(self):
+        dialog = ViewOptionsDialog(current_scale=self.image_scale, current_color=self.color_map, parent=self)
+        if dialog.exec_() == QtWidgets.QDialog.Accepted:
+            values = dialog.get_values()
+            if (values["scale"] is not None):
+                self.image_scale = values["scale"]
+            if (values["colormap"] is not None):
+                self.color_map = values["colormap"]
+
+    def open_command_dialog(self):
+        self.command_widget = CommandWriteWidget()
+        self.command_widget.write_command.connect(self.handle_write_command)
+        self.command_widget.show()
+
+    def open_camera_homography_dialog(self, start_addr=0x10):
+        self.set_camera_homography_widget = HomographyWidget(start_addr=start_addr)
+        self.set_camera_homography_widget.write_command.connect(self.handle_write_command)
+        self.set_camera_homography_widget.show()
+
+    def open_roi_dialog(self):
+        self.roi_widget = RoiSendWidget()
+        self.roi_widget.write_command.connect(self.handle_write_command)
+        self.roi_widget.show()
+
+    def open_dfdd_parameters_dialog(self):
+        self.dfdd_parameters_widget = DfddParametersSendWidget()
+        self.dfdd_parameters_widget.write_command.connect(self.handle_write_command)
+        self.dfdd_parameters_widget.show()
+
+    def handle_write_command(self, values):
+        if (values is not None): 
+            if(self.write_command_queue is None):
+                print("Handle write command ignored, not central channel")
+            else:
+                data = values["bytes"]
+                if self.registers is not None:
+                    data = self.registers.filter_writes(data)
+                    if not data:
+                        print("Write command: no register changed, nothing sent")
+                        return
+                self.write_command_queue.put(data)
+
+    def replay_registers(self):
+        if self.registers is None or self.write_command_queue is None:
+            return
+        data = self.registers.replay_all()
+        print(f"Replaying {len(self.registers)} registers")
+        if data:
+            self.write_command_queue.put(data)
+
+    def forget_registers(self):
+        if self.registers is not None:
+            self.registers.forget()
+
+    def update_status(self, text):
+        self.status.showMessage(text)
+
+
+
@@ -1,4 +1,3 @@
-import ftd2xx as ft
 import time
 import sys
 import numpy as np
@@ -55,7 +54,10 @@ class CaptureDialog(QtWidgets.QDialog):
         layout = QtWidgets.QFormLayout(self)
 
         self.frames_spin = QtWidgets.QSpinBox()
+        self.frames_spin.setRange(1, 100000)
         self.frames_spin.setValue(settings["frames"])
+        self.frames_spin.setToolTip("More than one frame is a burst: the frames are kept in memory "
+                                    "and written once the burst is complete")
 
         self.format_combo = QtWidgets.QComboBox()
         self.format_combo.addItems(["png", "binary", "numpy", "pbm"])
@@ -82,8 +84,7 @@ class CaptureDialog(QtWidgets.QDialog):
 
     def get_values(self):
         return {
-            #"frames": self.frames_spin.value(),
-            "frames": 1,
+            "frames": self.frames_spin.value(),
             "format": self.format_combo.currentText(),
             "filename": self.filename_edit.text(),
             "seperate_cameras": self.seperate_cams_checkbox.isChecked(),
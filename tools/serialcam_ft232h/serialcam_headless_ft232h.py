@@ -0,0 +1,142 @@
+# Headless capture: ft232h -> BinaryDecoder -> StreamDecoder -> disk.
+#
+# Meant for capture boxes where only recording matters, neither Qt nor
+# matplotlib are imported. Every decoded frame is appended (native byte order,
+# (height, width, channels) layout) to a raw file named after its shape:
+#     <output>_<width>x<height>x<channels>_<dtype>.raw
+# which can be loaded back with
+#     np.fromfile(path, dtype=dtype).reshape(-1, height, width, channels)
+# A summary of the capture metrics is printed periodically.
+#
+# With several boards (--boards), the frames of each board go to their own
+# files (<output>_<board>_...), only frames that could be aligned with the
+# other boards are written.
+
+import os
+import time
+import threading
+import queue
+
+from serialcam_stream_utils_ft232h import *
+from serialcam_tracing_ft232h import make_tracer
+
+# Writes the frames of frame_queue, packages are
+# (header_info, frame_np, frame_buffer)
+class HeadlessFrameWriter:
+    def __init__(self, frame_queue, output, tracer=None):
+        self.frame_queue   = frame_queue
+        self.tracer        = tracer
+        self.output        = output
+        self.files         = {}
+        self.lock          = threading.Lock()  # close() may run while a frame is being written
+        self.frames_meter  = metrics.meter("write.frames")
+        self.bytes_meter   = metrics.meter("write.bytes")
+
+        output_dir = os.path.dirname(output)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+    def run(self):
+        while True:
+            header_info, frame, frame_buffer = self.frame_queue.get()
+            try:
+                with self.lock:
+                    if self.files is None:
+                        continue  # closed, drop the frame
+                    frame.tofile(self.file_for(header_info, frame))
+                self.frames_meter.mark()
+                self.bytes_meter.mark(frame.nbytes)
+                if self.tracer is not None:
+                    self.tracer.finish(frame_buffer.trace, "written")
+            finally:
+                frame_buffer.release()
+
+    def file_for(self, header_info, frame):
+        width, height, channels, _ = header_info
+        path = f"{self.output}_{width}x{height}x{channels}_{frame.dtype.name}.raw"
+        f = self.files.get(path)
+        if f is None:
+            print(f"Headless: writing {width}x{height}x{channels} {frame.dtype.name} frames to {path}")
+            f = open(path, "ab")
+            self.files[path] = f
+        return f
+
+    def close(self):
+        with self.lock:
+            for f in self.files.values():
+                f.close()
+            self.files = None
+
+# Writes the aligned frame groups of several boards, one writer per board
+def execute_headless_multiboard(args, tracer):
+    from serialcam_multiboard_ft232h import start_multiboard
+    queue_config = stage_queue_config(args.queue)
+    writers = []
+    def write_group(group):
+        for pkg, writer in zip(group, writers):
+            pkg[2].retain()
+            writer.frame_queue.put(pkg)
+    boards = start_multiboard(args, queue.Queue(), write_group, tracer)
+    for board in boards:
+        frame_queue = StageQueue(*queue_config["record"], name=f"{board.name}.record", on_drop=release_package)
+        writers.append(HeadlessFrameWriter(frame_queue, f"{args.output}_{board.name}", tracer))
+    for writer in writers:
+        threading.Thread(target=writer.run, daemon=True).start()
+    return writers
+
+def execute_headless(args):
+    magic_bytes = b'BIVFRAME'
+    queue_config = stage_queue_config(args.queue)
+    tracer = make_tracer(args)
+    if args.boards != 1:
+        writers = execute_headless_multiboard(args, tracer)
+        return report_headless(args, writers)
+
+    rx_binary_queue = StageQueue(*queue_config["rx"], name="rx")
+    rx_stream_queue = StageQueue(*queue_config["stream"], name="stream")
+    # frames waiting to be written, this is a recording stage
+    frame_queue = StageQueue(*queue_config["record"], name="record", on_drop=release_package)
+    tx_binary_queue = queue.Queue()
+
+    binary_decoder = BinaryDecoder(rx_binary_queue, rx_stream_queue, magic_bytes, args.max_backlog_mb * 1024 * 1024, args.framing,
+                                   tracer)
+    stream_decoder = StreamDecoder(rx_stream_queue, None, None, None, queue.Queue(), args.fast, args.frame_pool_size,
+                                   frame_queue=frame_queue, tracer=tracer)
+    writer = HeadlessFrameWriter(frame_queue, args.output, tracer)
+
+    threads = [
+        threading.Thread(target=make_source(args, tracer), args=(rx_binary_queue, tx_binary_queue), daemon=True),
+        threading.Thread(target=binary_decoder.run, daemon=True),
+        threading.Thread(target=stream_decoder.run, daemon=True),
+        threading.Thread(target=writer.run, daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+    report_headless(args, [writer])
+
+# Prints a summary every few seconds until the duration is over (or ctrl-c),
+# then closes the writers
+def report_headless(args, writers):
+    metrics_writer = start_metrics_writer(args)
+    # the writers share their meters
+    frames_meter = writers[0].frames_meter
+    bytes_meter  = writers[0].bytes_meter
+    start_time = time.monotonic()
+    try:
+        while args.duration <= 0 or (time.monotonic() - start_time) < args.duration:
+            period = args.summary_period
+            if args.duration > 0:
+                # don't capture past the requested duration
+                period = min(period, args.duration - (time.monotonic() - start_time))
+            time.sleep(max(period, 0))
+            snapshot = metrics.snapshot()
+            backlog_dropped = sum(value for name, value in snapshot.items() if name.endswith("framing.dropped_bytes"))
+            print(f"Headless: {frames_meter.total} frames written, "
+                  f"{bytes_meter.window.rate() / 1e6:6.2f}MB/s to disk | {format_status_line(metrics)} "
+                  f"| backlog dropped {backlog_dropped}B")
+    except KeyboardInterrupt:
+        pass
+    for writer in writers:
+        writer.close()
+    if metrics_writer is not None:
+        metrics_writer.write()
@@ -0,0 +1,234 @@
+# Small metrics subsystem for the capture pipeline.
+#
+# Metrics live in a registry (one per process, 'metrics' below) under dotted
+# names such as "rx.bytes" or "queue.display0.dropped" (prefixed by the board
+# name, e.g. "board1.rx.bytes", when capturing from several boards):
+#   Counter  monotonically increasing count
+#   Gauge    current value, either set() or computed by a function at snapshot time
+#   Meter    counts events: total, rate over a sliding window and an EWMA rate
+#   Timer    durations: mean over a sliding window, last value and count
+# Sliding windows keep a running sum, so adding a sample and reading a rate
+# are O(1) (amortized) no matter how many samples are in the window.
+#
+# Snapshots (plain dicts) are used for the status bar and can be written
+# periodically to a JSON or text file by MetricsFileWriter.
+
+import collections
+import json
+import math
+import os
+import threading
+import time
+
+# Sum and count of the values added over the last window_s seconds
+class RollingWindow:
+    def __init__(self, window_s=1.0):
+        self.window_s   = window_s
+        self.samples    = collections.deque()
+        self.sum        = 0.0
+        self.start_time = None
+        self.lock       = threading.Lock()
+
+    def add(self, value, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if self.start_time is None:
+                self.start_time = now
+            self.samples.append((now, value))
+            self.sum += value
+            self._expire(now)
+
+    def rate(self, now=None):
+        """
+        Sum of the values per second over the window.
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self._expire(now)
+            if self.start_time is None:
+                return 0.0
+            # until a full window went by, divide by the time we have been running
+            span = min(self.window_s, now - self.start_time)
+            return self.sum / span if span > 0 else 0.0
+
+    def mean(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self._expire(now)
+            return self.sum / len(self.samples) if self.samples else 0.0
+
+    def _expire(self, now):
+        oldest = now - self.window_s
+        while self.samples and self.samples[0][0] <= oldest:
+            self.sum -= self.samples.popleft()[1]
+        if not self.samples:
+            self.sum = 0.0  # don't let rounding errors accumulate
+
+# Exponentially weighted moving average of an event rate (events/s). The rate
+# is updated on every event and decays when read after events stop coming.
+class EwmaRate:
+    def __init__(self, tau_s=1.0):
+        self.tau_s   = tau_s
+        self.rate    = 0.0
+        self.last    = None
+        self.pending = 0
+
+    def update(self, n, now=None):
+        now = time.monotonic() if now is None else now
+        if self.last is None:
+            self.last = now
+            return
+        self.pending += n
+        dt = now - self.last
+        if dt <= 0:
+            return
+        alpha = 1.0 - math.exp(-dt / self.tau_s)
+        self.rate += alpha * (self.pending / dt - self.rate)
+        self.pending = 0
+        self.last = now
+
+    def value(self, now=None):
+        """
+        The rate as of now, decayed over the time since the last event.
+        """
+        now = time.monotonic() if now is None else now
+        if self.last is None or now <= self.last:
+            return self.rate
+        return self.rate * math.exp(-(now - self.last) / self.tau_s)
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def snapshot(self):
+        return self.value
+
+class Gauge:
+    def __init__(self, fn=None):
+        self.fn    = fn
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return self.fn() if self.fn is not None else self.value
+
+# Meters can be shared by several threads (e.g. the per-board writers)
+class Meter:
+    def __init__(self, window_s=1.0, tau_s=1.0):
+        self.total  = 0
+        self.window = RollingWindow(window_s)
+        self.ewma   = EwmaRate(tau_s)
+        self.lock   = threading.Lock()
+
+    def mark(self, n=1):
+        now = time.monotonic()
+        with self.lock:
+            self.total += n
+            self.ewma.update(n, now)
+        self.window.add(n, now)
+
+    def snapshot(self):
+        with self.lock:
+            total, ewma = self.total, self.ewma.value()
+        return {"total": total, "rate": self.window.rate(), "ewma": ewma}
+
+class Timer:
+    def __init__(self, window_s=1.0):
+        self.count  = 0
+        self.last   = 0.0
+        self.window = RollingWindow(window_s)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.last = seconds
+        self.window.add(seconds)
+
+    def snapshot(self):
+        return {"mean": self.window.mean(), "last": self.last, "count": self.count}
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock    = threading.Lock()
+
+    def counter(self, name):
+        return self._get_or_create(name, Counter)
+
+    def gauge(self, name, fn=None):
+        """
+        Registers a gauge, if fn is given it is called at snapshot time (replacing any previous fn).
+        """
+        gauge = self._get_or_create(name, Gauge)
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def meter(self, name):
+        return self._get_or_create(name, Meter)
+
+    def timer(self, name):
+        return self._get_or_create(name, Timer)
+
+    def snapshot(self):
+        with self.lock:
+            items = list(self.metrics.items())
+        return {name: metric.snapshot() for name, metric in sorted(items)}
+
+    def _get_or_create(self, name, cls):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = cls()
+                self.metrics[name] = metric
+            return metric
+
+# Flattens a snapshot to "name.field value" lines
+def format_snapshot_text(snapshot):
+    lines = []
+    for name, value in snapshot.items():
+        if isinstance(value, dict):
+            for field, field_value in value.items():
+                lines.append(f"{name}.{field} {field_value}")
+        else:
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+# Periodically writes snapshots of a registry to path, as JSON if path ends
+# with .json, as "name value" lines otherwise. The file is replaced
+# atomically so scrapers never see a partial snapshot.
+class MetricsFileWriter:
+    def __init__(self, registry, path, period_s=5.0):
+        self.registry = registry
+        self.path     = path
+        self.period_s = period_s
+
+    def run(self):
+        while True:
+            time.sleep(self.period_s)
+            self.write()
+
+    def write(self):
+        snapshot = self.registry.snapshot()
+        if self.path.endswith(".json"):
+            text = json.dumps({"time": time.time(), "metrics": snapshot}, indent=1)
+        else:
+            text = format_snapshot_text(snapshot)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, self.path)
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+# Prefix of the metric names of a board in multi-board captures ("" for a single board)
+def board_prefix(board):
+    return f"{board}." if board else ""
+
+# The registry of this process
+metrics = MetricsRegistry()
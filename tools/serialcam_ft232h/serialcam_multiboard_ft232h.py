@@ -0,0 +1,161 @@
+# Multi-board capture.
+#
+# Every board (each FT232H whose serial number starts with --ftdi_sn_prefix,
+# or a synthetic source with --synthetic) gets its own reader, BinaryDecoder
+# and StreamDecoder with its own frame pool. Their logs, queues and metrics
+# are named after the board ("board0", "board1", ...).
+#
+# The decoded frames of all boards meet in one queue where a FrameAligner
+# groups them by arrival time: a group holds one frame of every board, all
+# completed within 'tolerance' seconds of each other. Frames that can't be
+# matched (a board skipped a frame or runs at another rate) are dropped and
+# counted in "merge.dropped".
+#
+# Commands are sent to every board.
+
+import collections
+import queue
+import threading
+
+from serialcam_stream_utils_ft232h import *
+
+# Returns the (board name, source) of every board to capture from
+def find_boards(args, tracer=None, tx_unsent_queue=None):
+    if args.replay:
+        raise SystemExit("--boards: a replay holds the stream of a single board")
+    if args.synthetic:
+        if args.boards <= 0:
+            raise SystemExit("--boards: give the number of synthetic boards")
+        channels = max(1, args.maxchannels // args.boards)
+        return [(f"board{i}", make_source(args, tracer, board=f"board{i}", channels=channels, seed=i))
+                for i in range(args.boards)]
+
+    if ft is None:
+        raise SystemExit("--boards: the ftd2xx module is required to read from FT232H boards")
+    sn_prefix = args.ftdi_sn_prefix.encode('utf-8')
+    serials = [sn for sn in (ft.listDevices() or []) if sn.startswith(sn_prefix)]
+    if len(serials) < max(args.boards, 1):
+        raise SystemExit(f"--boards: found {len(serials)} FT232H boards with a serial number starting with {sn_prefix}")
+    if args.boards > 0:
+        serials = serials[:args.boards]
+    boards = []
+    for i, serial_number in enumerate(serials):
+        print(f"Multi-board: board{i} is the FT232H with serial number {serial_number}")
+        boards.append((f"board{i}", make_source(args, tracer, board=f"board{i}", serial_number=serial_number,
+                                                tx_unsent_queue=tx_unsent_queue)))
+    return boards
+
+# Reader and decoders of one board, decoded frames go to frame_queue
+class BoardPipeline:
+    def __init__(self, name, source, args, frame_queue, tracer=None, magic_bytes=b'BIVFRAME'):
+        queue_config = stage_queue_config(args.queue)
+        self.name            = name
+        self.source          = source
+        self.rx_binary_queue = StageQueue(*queue_config["rx"], name=f"{name}.rx")
+        self.rx_stream_queue = StageQueue(*queue_config["stream"], name=f"{name}.stream")
+        self.tx_binary_queue = queue.Queue()
+        self.binary_decoder  = BinaryDecoder(self.rx_binary_queue, self.rx_stream_queue, magic_bytes,
+                                             args.max_backlog_mb * 1024 * 1024, args.framing, tracer, board=name)
+        self.stream_decoder  = StreamDecoder(self.rx_stream_queue, None, None, None, queue.Queue(), args.fast,
+                                             args.frame_pool_size, frame_queue=frame_queue, tracer=tracer, board=name)
+
+    def start(self):
+        threading.Thread(target=self.source, args=(self.rx_binary_queue, self.tx_binary_queue), daemon=True).start()
+        threading.Thread(target=self.binary_decoder.run, daemon=True).start()
+        threading.Thread(target=self.stream_decoder.run, daemon=True).start()
+
+# Groups the frames of several boards by arrival time (FrameBuffer.timestamp).
+# frame_queue packages are (header_info, frame_np, frame_buffer), the board
+# of a frame is known from the pool of its buffer. Every group (one package
+# per board, in board order) is handed to on_group, the aligner releases the
+# packages once on_group returns.
+class FrameAligner:
+    def __init__(self, frame_queue, pools, on_group, tolerance=0.005, max_pending=4):
+        """
+        :param tolerance: max difference (in seconds) between the arrival times of the frames of a group.
+        :param max_pending: frames kept per board while waiting for the other boards.
+        """
+        self.frame_queue  = frame_queue
+        self.board_of     = {id(pool): board for board, pool in enumerate(pools)}
+        self.pending      = [collections.deque() for _ in pools]
+        self.on_group     = on_group
+        self.tolerance    = tolerance
+        self.max_pending  = max_pending
+        self.groups_meter = metrics.meter("merge.groups")
+        self.dropped      = metrics.meter("merge.dropped")
+        self.skew_timer   = metrics.timer("merge.skew")
+
+    def run(self):
+        while True:
+            self.add(self.frame_queue.get())
+
+    def add(self, pkg):
+        pending = self.pending[self.board_of[id(pkg[2].pool)]]
+        pending.append(pkg)
+        if len(pending) > self.max_pending:
+            # the other boards are not sending anything close to these frames
+            self.drop(pending.popleft())
+        self.match()
+
+    def match(self):
+        while all(self.pending):
+            times = [pending[0][2].timestamp for pending in self.pending]
+            oldest = min(range(len(times)), key=times.__getitem__)
+            skew = max(times) - times[oldest]
+            if skew > self.tolerance:
+                # frames of a board arrive in order, nothing after the other
+                # heads can be closer to the oldest head: it has no match
+                self.drop(self.pending[oldest].popleft())
+                continue
+            group = [pending.popleft() for pending in self.pending]
+            self.groups_meter.mark()
+            self.skew_timer.observe(skew)
+            try:
+                self.on_group(group)
+            finally:
+                for pkg in group:
+                    release_package(pkg)
+
+    def drop(self, pkg):
+        self.dropped.mark()
+        release_package(pkg)
+
+# Hand the channels of a frame group to the display queue as a single channel
+# group (board 0 channels first, see publish_channels), taking one reference
+# per package. Every package carries the header of board 0 with the total
+# number of channels.
+def publish_group(display_queue, group, crop):
+    channels = sum(header_info[2] for header_info, _, _ in group)
+    width, height, _, data_width = group[0][0]
+    header_info = [width, height, channels, data_width]
+    pkgs = []
+    for board_header_info, frame, frame_buffer in group:
+        frame_buffer.retain(board_header_info[2])
+        pkgs += [(header_info, frame[:, :, c][crop], frame_buffer) for c in range(board_header_info[2])]
+    display_queue.put(pkgs)
+
+# Copies every command put on tx_binary_queue to the queue of every board
+def broadcast_commands(tx_binary_queue, board_tx_queues):
+    while True:
+        command = tx_binary_queue.get()
+        for board_tx_queue in board_tx_queues:
+            board_tx_queue.put(command)
+
+# Starts the pipelines of every board and the aligner, on_group(group) is
+# called with every aligned group. Returns the board pipelines.
+def start_multiboard(args, tx_binary_queue, on_group, tracer=None, tx_unsent_queue=None):
+    queue_config = stage_queue_config(args.queue)
+    board_sources = find_boards(args, tracer, tx_unsent_queue)
+    size, policy = queue_config["display"]
+    frame_queue = StageQueue(size * len(board_sources), policy, name="merge", on_drop=release_package)
+    boards = [BoardPipeline(name, source, args, frame_queue, tracer) for name, source in board_sources]
+    aligner = FrameAligner(frame_queue, [board.stream_decoder.pool for board in boards], on_group,
+                           args.merge_tolerance_ms / 1000)
+    print(f"Multi-board: capturing from {len(boards)} boards, frames are grouped within {args.merge_tolerance_ms}ms")
+
+    threading.Thread(target=aligner.run, daemon=True).start()
+    threading.Thread(target=broadcast_commands, args=(tx_binary_queue, [board.tx_binary_queue for board in boards]),
+                     daemon=True).start()
+    for board in boards:
+        board.start()
+    return boards
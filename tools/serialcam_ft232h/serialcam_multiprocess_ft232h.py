@@ -0,0 +1,196 @@
+# Multiprocess capture pipeline.
+#
+# The FT232H reader, BinaryDecoder and StreamDecoder run in a separate capture
+# process while the GUI stays in the main process, so the decode loops and the
+# GUI redraws don't contend for the same GIL.
+#
+# Decoded frames are written into shared memory buffers (SharedFramePool) and
+# only a small descriptor is sent to the GUI process:
+#     (shm_name, generation, shape, dtype_str, header_info, status_text, trace)
+# status_text is the status line built from the metrics of the capture
+# process, refreshed a few times per second (None in between).
+# The GUI process maps the buffer (the pixel data is never pickled), hands the
+# channel views to the display queues and, once every consumer released the
+# frame, sends shm_name back over the release queue so the capture process
+# can reuse the buffer.
+
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import threading
+import time
+import numpy as np
+
+from serialcam_stream_utils_ft232h import *
+from serialcam_tracing_ft232h import make_tracer
+from serialcam_recorder_ft232h import FrameRecorder, make_pretrigger
+
+# Frame pool whose buffers live in shared memory segments, one per buffer.
+# Buffers are also indexed by segment name so they can be released on
+# behalf of the GUI process.
+class SharedFramePool(FramePool):
+    def __init__(self, num_buffers=16):
+        super().__init__(num_buffers)
+        self.by_name = {}
+
+    def release_by_name(self, name):
+        frame = self.by_name.get(name)
+        if frame is not None:
+            frame.release()
+
+    def _new_buffer(self, shape, dtype):
+        nbytes = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        frame = FrameBuffer(self, np.ndarray(shape, dtype=dtype, buffer=shm.buf), self.generation)
+        frame.shm = shm
+        self.by_name[shm.name] = frame
+        return frame
+
+    def _discard(self, frame):
+        self.by_name.pop(frame.shm.name, None)
+        frame.array = None
+        frame.shm.unlink()
+        try:
+            frame.shm.close()
+        except BufferError:
+            # a view of the buffer is still alive, the mapping goes away with it
+            pass
+
+# Reference counted handle (same interface as FrameBuffer) to a frame living
+# in a shared memory segment of the capture process. The last release()
+# sends the segment name back to the capture process.
+class SharedFrameHandle:
+    def __init__(self, name, array, release_queue):
+        self.name          = name
+        self.array         = array
+        self.release_queue = release_queue
+        self.refs          = 1
+        self.lock          = threading.Lock()
+        self.trace         = None
+
+    def retain(self, n=1):
+        with self.lock:
+            self.refs += n
+
+    def release(self):
+        with self.lock:
+            self.refs -= 1
+            if self.refs != 0:
+                return
+        self.array = None
+        self.release_queue.put(self.name)
+
+# Runs in the GUI process: turns frame descriptors back into channel
+# packages for the display queues.
+class SharedFrameReceiver:
+    def __init__(self, descriptor_queue, release_queue, display_queue, window, fast=False, tracer=None):
+        self.descriptor_queue  = descriptor_queue
+        self.release_queue     = release_queue
+        self.display_queue     = display_queue
+        self.window            = window
+        self.crop              = display_crop(fast)
+        self.tracer            = tracer
+        # latest status line of the capture process, polled by the window
+        self.status_text       = ""
+        # attached segments of the current generation of buffers, by name
+        self.segments   = {}
+        self.generation = 0
+
+    def run(self):
+        while True:
+            name, generation, shape, dtype, header_info, status_text, trace = self.descriptor_queue.get()
+            shm = self.attach(name, generation)
+            frame = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+            handle = SharedFrameHandle(name, frame, self.release_queue)
+            handle.trace = trace
+            publish_channels(self.display_queue, header_info, frame, handle, self.crop)
+            handle.release()
+
+            if status_text is not None:
+                self.status_text = status_text
+            self.window.new_image_received.emit()
+
+    def attach(self, name, generation):
+        if generation > self.generation:
+            # the capture process reallocated its buffers, forget the old ones
+            for shm in self.segments.values():
+                try:
+                    shm.close()
+                except BufferError:
+                    pass
+            self.segments = {}
+            self.generation = generation
+        shm = self.segments.get(name)
+        if shm is None:
+            shm = shared_memory.SharedMemory(name=name)
+            self.segments[name] = shm
+        return shm
+
+# Runs in the capture process: sends a descriptor for every decoded frame
+def forward_frames(frame_queue, descriptor_queue, status_period=0.25):
+    last_status_time = 0.0
+    while True:
+        header_info, frame, frame_buffer = frame_queue.get()
+        status_text = None
+        now = time.monotonic()
+        if now - last_status_time > status_period:
+            status_text = format_status_line(metrics)
+            last_status_time = now
+        # the reference taken for frame_queue is now held by the GUI process
+        descriptor_queue.put((frame_buffer.shm.name, frame_buffer.generation, frame.shape,
+                              frame.dtype.str, header_info, status_text, frame_buffer.trace))
+
+# Runs in the capture process: gives back the buffers released by the GUI process
+def return_released_frames(release_queue, pool):
+    while True:
+        pool.release_by_name(release_queue.get())
+
+# Entry point of the capture process
+def capture_process(args, descriptor_queue, release_queue, tx_binary_queue, recorder_request_queue, tx_unsent_queue):
+    magic_bytes = b'BIVFRAME'
+    queue_config = stage_queue_config(args.queue)
+
+    rx_binary_queue = StageQueue(*queue_config["rx"], name="rx")
+    rx_stream_queue = StageQueue(*queue_config["stream"], name="stream")
+    # frames waiting for a descriptor to be sent, drops give the buffer back
+    # (sized like the display queue, "display" names the GUI side one)
+    frame_queue = StageQueue(*queue_config["display"], name="forward", on_drop=release_package)
+    recorder = FrameRecorder(*queue_config["capture"], num_writers=args.capture_writers,
+                             max_burst_bytes=args.burst_max_mb * 1024 * 1024).start()
+    pool = SharedFramePool(args.frame_pool_size)
+    # stamps the capture side of the traces, they are finished in the GUI process
+    tracer = make_tracer(args)
+
+    binary_decoder = BinaryDecoder(rx_binary_queue, rx_stream_queue, magic_bytes, args.max_backlog_mb * 1024 * 1024, args.framing,
+                                   tracer)
+    stream_decoder = StreamDecoder(rx_stream_queue, None, None, recorder, recorder_request_queue, args.fast,
+                                   frame_queue=frame_queue, pool=pool, tracer=tracer,
+                                   pretrigger=make_pretrigger(args))
+    start_metrics_writer(args)
+
+    threads = [
+        threading.Thread(target=make_source(args, tracer, tx_unsent_queue=tx_unsent_queue),
+                         args=(rx_binary_queue, tx_binary_queue), daemon=True),
+        threading.Thread(target=binary_decoder.run, daemon=True),
+        threading.Thread(target=stream_decoder.run, daemon=True),
+        threading.Thread(target=return_released_frames, args=(release_queue, pool), daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+    forward_frames(frame_queue, descriptor_queue)
+
+# Starts the capture process, returns it with the queues used to talk to it:
+# (process, descriptor_queue, release_queue, tx_binary_queue, recorder_request_queue, tx_unsent_queue)
+def start_capture_process(args):
+    # spawn rather than fork, the GUI process may already have Qt state
+    ctx = mp.get_context("spawn")
+    descriptor_queue       = ctx.Queue()
+    release_queue          = ctx.Queue()
+    tx_binary_queue        = ctx.Queue()
+    recorder_request_queue = ctx.Queue()
+    tx_unsent_queue        = ctx.Queue()
+    process = ctx.Process(target=capture_process,
+                          args=(args, descriptor_queue, release_queue, tx_binary_queue, recorder_request_queue,
+                                tx_unsent_queue),
+                          daemon=True)
+    process.start()
+    return process, descriptor_queue, release_queue, tx_binary_queue, recorder_request_queue, tx_unsent_queue
@@ -0,0 +1,445 @@
+# Frame recorder: a pool of writer threads saving the frames requested from
+# the Capture dialog, so the StreamDecoder never waits on encoding or disk I/O.
+#
+# The decoder submits a RecordJob per frame; it holds a reference on the
+# pooled frame buffer (no copy), which the writer releases once the frame is
+# on disk. Jobs go through the "capture" StageQueue (drop-newest by default):
+# when the writers fall behind, frames are dropped (queue.capture.dropped)
+# rather than stalling the decoder.
+#
+# Formats, every file is named <base>[_<channel>]<tag>, the decoder tags the
+# frames with _<width>_<height>[_<remaining>]_<id>:
+#   png:    8-bit PNG, samples shifted down to their 8 most significant bits
+#   binary: raw samples (native byte order, full data_width precision),
+#           "_<dtype>.bin" is appended to the name, the channels of a
+#           frame are interleaved, (height, width, channels) layout
+#   numpy:  .npy file of the samples (full precision)
+#   pbm:    binary graymap (PGM "P5") with maxval 2^data_width - 1, 16-bit
+#           big-endian samples past 8 bits (full precision up to 16 bits)
+# Without seperate_cameras a single file holds every channel: the channels are
+# placed side by side for png/pbm, and kept as is for binary/numpy.
+#
+# Requests of several frames are bursts (see BurstCapture): the frames are
+# copied into RAM reserved up front, at line rate, and only written out once
+# the burst is complete. Progress is published as the "capture.burst.*"
+# metrics (target, captured, dropped, written) shown in the status line.
+#
+# With a PretriggerRing the most recent frames are always kept in memory; a
+# trigger writes the last seconds before it and the frames that follow for a
+# set time, as raw files (see PretriggerRing).
+
+import os
+import json
+import math
+import signal
+import time
+import queue
+import threading
+from collections import namedtuple
+from functools import partial
+import numpy as np
+import cv2
+from serialcam_stream_utils_ft232h import StageQueue, metrics
+
+RecordJob = namedtuple("RecordJob", "output_dir base tag header_info frame frame_buffer format separate")
+
+class FrameRecorder:
+    FORMATS = ("png", "binary", "numpy", "pbm")
+
+    def __init__(self, queue_size=64, policy="drop-newest", num_writers=2, max_burst_bytes=2 << 30):
+        self.jobs = StageQueue(queue_size, policy, name="capture", on_drop=self.release_job)
+        self.num_writers  = num_writers
+        self.frames_meter = metrics.meter("capture.frames")
+        self.bytes_meter  = metrics.meter("capture.bytes")
+        self.errors       = metrics.counter("capture.errors")
+
+        # the current (or last) burst
+        self.max_burst_bytes = max_burst_bytes
+        self.burst = None
+        for field in ("target", "captured", "dropped", "written"):
+            metrics.gauge(f"capture.burst.{field}", partial(self.burst_field, field))
+
+    def start(self):
+        for i in range(self.num_writers):
+            threading.Thread(target=self.run, name=f"capture writer {i}", daemon=True).start()
+        return self
+
+    def submit(self, output_dir, base, tag, header_info, frame, frame_buffer=None, format="png", separate=True):
+        """
+        Queues a (height, width, channels) frame for writing, never blocks
+        with the default queue policy.
+        """
+        if format not in self.FORMATS:
+            raise ValueError(f"Unknown capture format {format}")
+        if frame_buffer is not None:
+            frame_buffer.retain()
+        self.jobs.put(RecordJob(output_dir, base, tag, header_info, frame, frame_buffer, format, separate))
+
+    def start_burst(self, frames, output_dir, base, first_id, format="png", separate=True, lost_fn=None):
+        """
+        Returns a new BurstCapture of up to 'frames' frames, to be filled by
+        the decoder and handed back to flush_burst() once done.
+        """
+        if format not in self.FORMATS:
+            raise ValueError(f"Unknown capture format {format}")
+        self.burst = BurstCapture(frames, output_dir, base, first_id, format, separate, self.max_burst_bytes, lost_fn)
+        return self.burst
+
+    def flush_burst(self, burst):
+        """
+        Writes the frames of a finished burst from a background thread.
+        """
+        threading.Thread(target=self.write_burst, args=(burst,), name="capture burst", daemon=True).start()
+
+    def write_burst(self, burst):
+        start = time.monotonic()
+        for job in burst.jobs():
+            try:
+                self.write(job)
+                self.frames_meter.mark()
+            except Exception as e:
+                self.errors.inc()
+                print(f"Capture: could not write {job.base}{job.tag}: {e}")
+            burst.written += 1
+        print(f"Capture: burst of {burst.captured}/{burst.target} frames ({burst.dropped} dropped) "
+              f"written in {time.monotonic() - start:.1f}s")
+        burst.ring = None  # give the memory back
+
+    def burst_field(self, field):
+        return getattr(self.burst, field) if self.burst is not None else 0
+
+    @staticmethod
+    def release_job(job):
+        if job.frame_buffer is not None:
+            job.frame_buffer.release()
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                self.write(job)
+                self.frames_meter.mark()
+            except Exception as e:
+                self.errors.inc()
+                print(f"Capture: could not write {job.base}{job.tag}: {e}")
+            finally:
+                self.release_job(job)
+
+    def write(self, job):
+        width, height, channels, data_width = job.header_info
+        if job.output_dir:
+            os.makedirs(job.output_dir, exist_ok=True)
+        base = os.path.join(job.output_dir, job.base)
+        frame = job.frame
+        if job.separate:
+            planes = [(f"{base}_{c}{job.tag}", frame[:, :, c]) for c in range(channels)]
+        elif job.format in ("png", "pbm"):
+            planes = [(base + job.tag, np.hstack([frame[:, :, c] for c in range(channels)]))]
+        else:
+            planes = [(base + job.tag, frame)]
+        for path, plane in planes:
+            self.bytes_meter.mark(self.write_plane(path, plane, job.format, data_width))
+
+    # Writes the file of one plane, returns the number of sample bytes
+    def write_plane(self, path, plane, format, data_width):
+        path = path + self.suffix(format, plane.dtype)
+        if format == "png":
+            shift = max(data_width - 8, 0)
+            cv2.imwrite(path, (plane >> shift).astype(np.uint8))
+            return plane.size
+        if format == "binary":
+            plane.tofile(path)
+            return plane.nbytes
+        if format == "numpy":
+            np.save(path, plane)
+            return plane.nbytes
+        return write_pgm(path, plane, data_width)
+
+    @staticmethod
+    def suffix(format, dtype):
+        return {"png": ".png", "binary": f"_{dtype.name}.bin", "numpy": ".npy", "pbm": ".pgm"}[format]
+
+# Writes a 2D plane as a binary PGM (P5), returns the number of sample bytes
+def write_pgm(path, plane, data_width):
+    if data_width > 16:
+        # PGM samples are 16 bits at most, keep the most significant ones
+        plane = plane >> (data_width - 16)
+        data_width = 16
+    maxval = (1 << data_width) - 1
+    height, width = plane.shape
+    samples = np.ascontiguousarray(plane, dtype=">u2" if maxval > 255 else np.uint8)
+    with open(path, "wb") as f:
+        f.write(f"P5\n{width} {height}\n{maxval}\n".encode("ascii"))
+        f.write(samples.tobytes())
+    return samples.nbytes
+
+# Frames of a multi-frame capture request, held in RAM until the burst ends.
+# The ring of 'frames' slots is allocated (and its pages touched) in a
+# background thread on the first frame, which gives its shape; frames only
+# start being captured once it is ready, then each is a single copy. The
+# number of slots is reduced to fit max_bytes. Frames lost by the decoder
+# while the burst runs (lost_fn, e.g. pool exhaustion and stream drops) or
+# that do not match the ring shape are counted in 'dropped'.
+class BurstCapture:
+    def __init__(self, frames, output_dir, base, first_id, format, separate, max_bytes, lost_fn=None):
+        self.target     = frames
+        self.output_dir = output_dir
+        self.base       = base
+        self.first_id   = first_id
+        self.format     = format
+        self.separate   = separate
+        self.max_bytes  = max_bytes
+        self.lost_fn    = lost_fn
+        self.ring       = None
+        self.headers    = []
+        self.ready      = threading.Event()
+        self.allocating = False
+        self.captured   = 0
+        self.dropped    = 0
+        self.written    = 0
+        self.mismatched = 0
+        self.lost_start = 0
+
+    def allocate(self, shape, dtype):
+        frame_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        slots = min(self.target, max(1, self.max_bytes // frame_bytes))
+        if slots < self.target:
+            print(f"Capture: burst limited to {slots} frames ({self.max_bytes / 2**20:.0f}MB)")
+            self.target = slots
+        ring = np.empty((slots,) + tuple(shape), dtype=dtype)
+        ring.fill(0)  # fault the pages in now rather than during the burst
+        self.ring = ring
+        self.ready.set()
+
+    def add(self, header_info, frame):
+        """
+        Copies a frame into the next slot, returns True once the burst is done.
+        """
+        if not self.ready.is_set():
+            if not self.allocating:
+                self.allocating = True
+                threading.Thread(target=self.allocate, args=(frame.shape, frame.dtype),
+                                 name="capture burst alloc", daemon=True).start()
+            return False
+        lost = self.lost_fn() if self.lost_fn is not None else 0
+        if self.captured == 0 and not self.mismatched:
+            self.lost_start = lost
+        if frame.shape != self.ring.shape[1:] or frame.dtype != self.ring.dtype:
+            self.mismatched += 1
+        else:
+            np.copyto(self.ring[self.captured], frame)
+            self.headers.append(list(header_info))
+            self.captured += 1
+        self.dropped = lost - self.lost_start + self.mismatched
+        return self.captured >= self.target
+
+    def jobs(self):
+        # same naming as single frame captures: _<width>_<height>_<remaining>_<id>
+        for i in range(self.captured):
+            width, height = self.headers[i][:2]
+            tag = f"_{width}_{height}_{self.captured - 1 - i}_{self.first_id + i}"
+            yield RecordJob(self.output_dir, self.base, tag, self.headers[i], self.ring[i], None,
+                            self.format, self.separate)
+
+# Fixed-memory ring of the most recent frames (with their arrival times),
+# filled by the StreamDecoder. trigger() writes out the frames received in the
+# pre_seconds before it, then every frame received in the post_seconds after
+# it, from a writer thread. The dump ends with the first frame received past
+# the post-trigger time.
+#
+# Slots queued for writing are pinned; a frame arriving while the next slot is
+# still pinned (the writer is behind) is dropped. A dump is one raw file in the
+# layout of the headless writer,
+#     <base>_<width>x<height>x<channels>_<dtype>.raw
+# next to <base>.json holding the header and the frame times relative to the
+# trigger.
+#
+# The ring holds pre_seconds + post_seconds of frames (the post-trigger frames
+# go to the slots not pinned by the dump) at the frame rate measured over the
+# first RATE_WINDOW_S seconds of frames, max_bytes only caps it. The ring is
+# allocated once (the decoder never waits on a reallocation), if the frame
+# rate goes up it holds fewer seconds and a warning is printed. It is only
+# reallocated when the frame shape changes while no dump is being written.
+# A dump also ends when no frame arrives past the post-trigger time.
+class PretriggerRing:
+    RATE_WINDOW_S = 0.5
+    MARGIN        = 1.25   # extra slots for frame rate jitter and writer lag
+
+    def __init__(self, pre_seconds, post_seconds=2.0, max_bytes=1 << 30):
+        self.pre_seconds  = pre_seconds
+        self.post_seconds = post_seconds
+        self.max_bytes    = max_bytes
+        self.rate_key     = None         # (shape, dtype) whose frame rate is being measured
+        self.rate_start   = 0.0
+        self.rate_frames  = 0
+        self.short_warned = False        # warned that the ring holds fewer seconds than asked
+        self.lock    = threading.Lock()
+        self.pending = queue.Queue()     # dump requests, slot indices, None ends a dump
+        self.ring    = None
+        self.times   = None
+        self.pinned  = None
+        self.headers = []
+        self.next    = 0
+        self.count   = 0
+        self.post_until = None           # set while a dump is running
+        self.written = 0
+        self.dropped = 0
+        metrics.gauge("capture.trigger.buffered", lambda: self.count)
+        metrics.gauge("capture.trigger.written", lambda: self.written)
+        metrics.gauge("capture.trigger.dropped", lambda: self.dropped)
+
+    def start(self):
+        threading.Thread(target=self.run, name="capture trigger writer", daemon=True).start()
+        return self
+
+    def measure_rate(self, frame, timestamp):
+        """
+        Returns the frame rate once frames of this shape were received for
+        RATE_WINDOW_S seconds, None until then.
+        """
+        key = (frame.shape, frame.dtype)
+        if key != self.rate_key:
+            self.rate_key, self.rate_start, self.rate_frames = key, timestamp, 0
+        self.rate_frames += 1
+        elapsed = timestamp - self.rate_start
+        if elapsed < self.RATE_WINDOW_S:
+            return None
+        return (self.rate_frames - 1) / elapsed
+
+    def slots_for(self, shape, dtype, fps):
+        frame_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        max_slots = max(2, self.max_bytes // frame_bytes)
+        slots = math.ceil((self.pre_seconds + self.post_seconds) * fps * self.MARGIN) + 2
+        return min(slots, max_slots), max_slots
+
+    def allocate(self, shape, dtype, fps):
+        slots, max_slots = self.slots_for(shape, dtype, fps)
+        self.ring    = np.empty((slots,) + tuple(shape), dtype=dtype)
+        self.times   = np.zeros(slots)
+        self.pinned  = np.zeros(slots, dtype=bool)
+        self.headers = [None] * slots
+        self.next    = 0
+        self.count   = 0
+        self.short_warned = False
+        capped = " (capped by --pretrigger_mb)" if slots == max_slots else ""
+        print(f"Capture: pre-trigger ring of {slots} frames at {fps:.1f}fps "
+              f"({self.ring.nbytes / 2**20:.0f}MB){capped}")
+
+    def add(self, header_info, frame, timestamp):
+        """
+        Copies a decoded (height, width, channels) frame into the ring.
+        """
+        with self.lock:
+            if self.ring is None or frame.shape != self.ring.shape[1:] or frame.dtype != self.ring.dtype:
+                if self.post_until is not None or (self.pinned is not None and self.pinned.any()):
+                    self.dropped += 1  # no reallocation while a dump is being written
+                    return
+                fps = self.measure_rate(frame, timestamp)
+                if fps is None:
+                    return
+                self.allocate(frame.shape, frame.dtype, fps)
+            if self.post_until is not None and timestamp > self.post_until:
+                self.post_until = None
+                self.pending.put(None)
+            i = self.next
+            if self.pinned[i]:
+                self.dropped += 1
+                return
+            np.copyto(self.ring[i], frame)
+            self.times[i]   = timestamp
+            self.headers[i] = list(header_info)
+            self.next  = (i + 1) % len(self.ring)
+            self.count = min(self.count + 1, len(self.ring))
+            if self.post_until is not None:
+                self.pinned[i] = True
+                self.pending.put(i)
+            elif self.next == 0 and not self.short_warned:
+                # wrapped around, check the seconds the ring holds at the current rate
+                span = timestamp - self.times[0]
+                if 0 < span < self.pre_seconds:
+                    self.short_warned = True
+                    print(f"Capture: the pre-trigger ring only holds {span:.2f}s of frames at the current "
+                          f"frame rate (--pretrigger_s {self.pre_seconds}, see --pretrigger_mb)")
+
+    def trigger(self, output_dir, base, now=None):
+        """
+        Starts writing the buffered frames of the last pre_seconds, a trigger
+        during a dump extends it.
+        """
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            if self.post_until is not None:
+                self.post_until = now + self.post_seconds
+                return
+            if self.ring is None:
+                print("Capture: trigger ignored, no frame received yet")
+                return
+            self.post_until = now + self.post_seconds
+            self.pending.put((output_dir, base, now))
+            n = len(self.ring)
+            for k in range(self.count):
+                i = (self.next - self.count + k) % n
+                if self.times[i] >= now - self.pre_seconds:
+                    self.pinned[i] = True
+                    self.pending.put(i)
+
+    def end_dump_if_due(self):
+        # no frame arrived past the post-trigger time (the stream stopped)
+        with self.lock:
+            if self.post_until is not None and time.monotonic() > self.post_until:
+                self.post_until = None
+                self.pending.put(None)
+
+    def run(self):
+        f = None
+        while True:
+            try:
+                item = self.pending.get(timeout=0.25)
+            except queue.Empty:
+                self.end_dump_if_due()
+                continue
+            if isinstance(item, tuple):
+                output_dir, base, trigger_time = item
+                f, meta, path = None, None, os.path.join(output_dir, base)
+                if output_dir:
+                    os.makedirs(output_dir, exist_ok=True)
+            elif item is None:
+                if f is not None:
+                    f.close()
+                    with open(path + ".json", "w") as jf:
+                        json.dump(meta, jf, indent=1)
+                    print(f"Capture: trigger dump of {len(meta['times'])} frames written to {f.name}")
+                f = None
+            else:
+                frame  = self.ring[item]
+                header = self.headers[item]
+                try:
+                    if f is None:
+                        width, height, channels, data_width = header
+                        f = open(f"{path}_{width}x{height}x{channels}_{frame.dtype.name}.raw", "wb")
+                        meta = {"width": width, "height": height, "channels": channels, "data_width": data_width,
+                                "dtype": frame.dtype.name, "times": []}
+                    frame.tofile(f)
+                    meta["times"].append(round(float(self.times[item]) - trigger_time, 6))
+                    self.written += 1
+                except Exception as e:
+                    print(f"Capture: could not write trigger frame: {e}")
+                finally:
+                    with self.lock:
+                        self.pinned[item] = False
+
+# Returns the pre-trigger ring configured by --pretrigger_s, None when off
+def make_pretrigger(args):
+    if args.pretrigger_s <= 0:
+        return None
+    return PretriggerRing(args.pretrigger_s, args.posttrigger_s, args.pretrigger_mb * 1024 * 1024).start()
+
+# Capture request that fires the pre-trigger ring (sent on the recorder request queue)
+def trigger_request(output_dir="triggers"):
+    return {"trigger": True, "filename": output_dir + "/" + time.strftime("trigger-%Y-%m-%d_%H-%M-%S")}
+
+# Fires the pre-trigger ring on SIGUSR1 (e.g. "kill -USR1 <pid>" from a script)
+def install_trigger_signal(recorder_request_queue):
+    if not hasattr(signal, "SIGUSR1"):
+        return
+    signal.signal(signal.SIGUSR1, lambda signum, frame: recorder_request_queue.put(trigger_request()))
@@ -0,0 +1,103 @@
+# Host-side shadow of the controller's command-mapped registers.
+#
+# Commands are 6 byte packets: data (4 bytes) then address (2 bytes), both
+# little-endian. The registers are write-only, so the shadow remembers the
+# last value handed to the TX path for every mapped address and drops the
+# writes that wouldn't change anything. Addresses outside the map are always
+# sent (and not remembered).
+#
+# The TX path reports the packets it could not write (a stalled device) on
+# unsent_queue, the shadow forgets those values before filtering the next
+# writes so they are sent again.
+#
+# After an FPGA reset the registers go back to their defaults, replay_all()
+# then returns every remembered value as a single batch.
+
+import struct
+import queue
+
+from serialcam_metrics_ft232h import metrics
+
+COMMAND_PACKET = struct.Struct("<IH")
+
+# (name, first address, number of registers), from rtl/controller.sv
+REGISTER_MAP = [
+    ("depth_max",       0x00, 16),
+    ("homography_cam1", 0x10, 9),
+    ("homography_cam0", 0x20, 9),
+    ("depth_min",       0x30, 16),
+    ("confidence_min",  0x50, 16),
+    ("centers",         0x60, 2),   # col, row
+    ("r_squared",       0x70, 16),
+    ("roi",             0x80, 4),
+    ("a_scale1",        0x90, 16),
+    ("a_scale0",        0xa0, 16),
+    ("b_scale0",        0xb0, 16),
+    ("w0",              0xc0, 2),
+    ("w1",              0xd0, 2),
+    ("w2",              0xe0, 2),
+    ("b_scale1",        0xf0, 16),
+]
+
+class ShadowRegisterFile:
+    def __init__(self, register_map=REGISTER_MAP, unsent_queue=None):
+        self.addresses = {start + i for _, start, count in register_map for i in range(count)}
+        # address -> last value sent
+        self.values       = {}
+        self.unsent_queue = unsent_queue
+        self.written      = metrics.counter("registers.written")
+        self.suppressed   = metrics.counter("registers.suppressed")
+        self.unsent       = metrics.counter("registers.unsent")
+
+    def forget_unsent(self):
+        """
+        Forgets the values of the packets reported on unsent_queue, unless a
+        newer value was written since.
+        """
+        if self.unsent_queue is None:
+            return
+        while True:
+            try:
+                data = self.unsent_queue.get_nowait()
+            except queue.Empty:
+                return
+            whole = len(data) - len(data) % COMMAND_PACKET.size
+            for value, addr in COMMAND_PACKET.iter_unpack(data[:whole]):
+                if self.values.get(addr) == value:
+                    del self.values[addr]
+                    self.unsent.inc()
+
+    def filter_writes(self, data):
+        """
+        Returns the packets of data that change a register (or target an unmapped address).
+        """
+        self.forget_unsent()
+        changed = []
+        whole = len(data) - len(data) % COMMAND_PACKET.size
+        for value, addr in COMMAND_PACKET.iter_unpack(data[:whole]):
+            if addr in self.addresses:
+                if self.values.get(addr) == value:
+                    self.suppressed.inc()
+                    continue
+                self.values[addr] = value
+                self.written.inc()
+            changed.append(COMMAND_PACKET.pack(value, addr))
+        # not a whole packet, pass it through untouched
+        changed.append(data[whole:])
+        return b"".join(changed)
+
+    def replay_all(self):
+        """
+        Returns the packets writing every known register, in address order.
+        """
+        self.forget_unsent()
+        return b"".join(COMMAND_PACKET.pack(self.values[addr], addr) for addr in sorted(self.values))
+
+    def forget(self):
+        """
+        Forgets every value, the next write of each register is always sent.
+        """
+        self.values.clear()
+
+    def __len__(self):
+        return len(self.values)
@@ -0,0 +1,226 @@
+# Byte stream sources other than a live FT232H board, and raw stream recording.
+#
+# A source is a function source(rx_binary_queue, tx_binary_queue) that puts
+# chunks of bytes on rx_binary_queue, exactly like ft232h() does.
+#
+# Raw stream files hold the bytes exactly as they were read from the device,
+# with their chunk boundaries and receive times:
+#     b'BIVRAW01'
+#     then per chunk: timestamp (float64, seconds, monotonic clock),
+#                     length (uint32), data (length bytes)
+# all little-endian.
+
+import struct
+import time
+import queue
+import threading
+import numpy as np
+from serialcam_metrics_ft232h import metrics, board_prefix
+
+RAW_STREAM_MAGIC = b'BIVRAW01'
+RAW_CHUNK_HEADER = struct.Struct("<dI")
+
+# Records the raw chunks read from the device. write() only queues the chunk,
+# the file is written (and flushed) by a writer thread so a slow disk doesn't
+# stall the reads. If more than max_queued chunks are waiting, new chunks are
+# left out of the recording and counted in rx.raw_dropped.
+class RawStreamWriter:
+    def __init__(self, path, max_queued=1024, board=""):
+        self.path = path
+        self.file = open(path, "wb")
+        self.file.write(RAW_STREAM_MAGIC)
+        self.chunks = 0
+        self.total_bytes = 0
+        self.dropped = 0
+        self.pending = queue.Queue(max_queued)
+        metrics.gauge(board_prefix(board) + "rx.raw_dropped", lambda: self.dropped)
+        self.thread = threading.Thread(target=self.run, name="raw stream writer", daemon=True)
+        self.thread.start()
+
+    def write(self, chunk, timestamp=None):
+        if timestamp is None:
+            timestamp = time.monotonic()
+        try:
+            self.pending.put_nowait((timestamp, chunk))
+        except queue.Full:
+            if self.dropped == 0:
+                print(f"Raw recording: the disk can't keep up, chunks are missing from {self.path}")
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            timestamp, chunk = item
+            self.file.write(RAW_CHUNK_HEADER.pack(timestamp, len(chunk)))
+            self.file.write(chunk)
+            self.chunks += 1
+            self.total_bytes += len(chunk)
+            # the reader thread is a daemon, don't leave chunks sitting in the buffer
+            if self.pending.empty():
+                self.file.flush()
+        self.file.close()
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+
+# Yields (timestamp, chunk) for every chunk of a raw stream file
+def read_raw_stream(path):
+    with open(path, "rb") as f:
+        if f.read(len(RAW_STREAM_MAGIC)) != RAW_STREAM_MAGIC:
+            raise ValueError(f"{path} is not a raw stream recording")
+        while True:
+            chunk_header = f.read(RAW_CHUNK_HEADER.size)
+            if len(chunk_header) < RAW_CHUNK_HEADER.size:
+                return
+            timestamp, length = RAW_CHUNK_HEADER.unpack(chunk_header)
+            chunk = f.read(length)
+            if len(chunk) < length:
+                return  # truncated recording
+            yield timestamp, chunk
+
+# Drain (and ignore) the commands meant for the FPGA, there is none to talk to
+def discard_tx(tx_binary_queue, source_name):
+    while True:
+        try:
+            txdata = tx_binary_queue.get_nowait()
+            print(f"{source_name}: ignoring {txdata}, there is no FPGA to send it to")
+        except queue.Empty:
+            return
+
+# Feeds a raw stream recording into rx_binary_queue.
+# speed is a multiple of the original rate, speed <= 0 replays as fast as
+# the decoders can keep up.
+def replay_source(rx_binary_queue, tx_binary_queue, path, speed=1.0, loop=False, tracer=None):
+    print(f"Replay Thread: replaying {path} at " + (f"{speed}x speed" if speed > 0 else "full speed"))
+    rx_bytes = metrics.meter("rx.bytes")
+    while True:
+        start_time = time.monotonic()
+        first_timestamp = None
+        total_bytes = 0
+        for timestamp, chunk in read_raw_stream(path):
+            if tracer is not None:
+                tracer.chunk_received(chunk)
+            if speed > 0:
+                if first_timestamp is None:
+                    first_timestamp = timestamp
+                delay = start_time + (timestamp - first_timestamp) / speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            rx_binary_queue.put(chunk)
+            total_bytes += len(chunk)
+            rx_bytes.mark(len(chunk))
+            if tx_binary_queue is not None:
+                discard_tx(tx_binary_queue, "Replay Thread")
+
+        elapsed = time.monotonic() - start_time
+        print(f"Replay Thread: replayed {total_bytes/1e6:8.2f}MB in {elapsed:6.2f}s "
+              f"({total_bytes / max(elapsed, 1e-9) / 1e6:6.2f}MB/s)")
+        if not loop:
+            return
+
+# Builds valid BIVFRAME frames (magic bytes, the 6 byte header, then the
+# interleaved BIG-ENDIAN samples) with a moving test pattern. A handful of
+# distinct frames are built up front so generating them costs nothing.
+class SyntheticFrameGenerator:
+    def __init__(self, width=640, height=480, channels=2, data_width=16, magic_bytes=b'BIVFRAME', pattern_frames=8):
+        if data_width <= 0 or data_width % 8 != 0 or data_width > 64:
+            raise ValueError(f"Unsupported data width {data_width}")
+        self.width      = width
+        self.height     = height
+        self.channels   = channels
+        self.data_width = data_width
+        self.header = (magic_bytes + width.to_bytes(2, 'big') + height.to_bytes(2, 'big')
+                       + bytes([channels, data_width]))
+        self.frames = [self.header + self.payload(i, pattern_frames) for i in range(pattern_frames)]
+
+    def payload(self, index, pattern_frames):
+        # diagonal gradient, shifted every frame, with a different offset per channel
+        rows = np.arange(self.height, dtype=np.uint64).reshape(-1, 1, 1)
+        cols = np.arange(self.width, dtype=np.uint64).reshape(1, -1, 1)
+        chans = np.arange(self.channels, dtype=np.uint64).reshape(1, 1, -1)
+        shift = index * max(1, self.width // pattern_frames)
+        max_value = (1 << self.data_width) - 1 if self.data_width < 64 else (1 << 64) - 1
+        values = (rows + cols + shift + chans * 64) * max(1, max_value // 1024)
+        values = (values & np.uint64(max_value))
+
+        nbytes = self.data_width // 8
+        big_endian = values.astype(">u8").view(np.uint8).reshape(-1, 8)
+        return big_endian[:, 8 - nbytes:].tobytes()
+
+    def frame(self, index):
+        return self.frames[index % len(self.frames)]
+
+# Corrupts a frame in one of several ways a real link could, returns (kind, data)
+def corrupt_frame(frame, rng, header_len=14):
+    kind = rng.choice(["flip", "truncate", "magic", "junk"])
+    data = bytearray(frame)
+    if kind == "flip":
+        data[rng.integers(header_len, len(data))] ^= 0xff
+    elif kind == "truncate":
+        del data[rng.integers(header_len, len(data)):]
+    elif kind == "magic":
+        data[rng.integers(0, 8)] ^= 0xff
+    else:
+        data[rng.integers(0, len(data)):0] = rng.bytes(int(rng.integers(1, 64)))
+    return kind, bytes(data)
+
+# Feeds synthetic BIVFRAME frames into rx_binary_queue.
+#   fps:          frame rate, <= 0 generates as fast as the decoders keep up
+#   chunk_size:   (min, max) size of the chunks put on the queue, chunks split
+#                 frames (and headers) at random positions
+#   corruption:   probability for each frame to be corrupted
+#   frames:       number of frames to generate, <= 0 runs forever
+#   board:        name of the simulated board (multi-board captures)
+def synthetic_source(rx_binary_queue, tx_binary_queue, width=640, height=480, channels=2, data_width=16,
+                     fps=0, chunk_size=(64 * 1024, 1024 * 1024), corruption=0.0, frames=0, seed=0,
+                     stats_print_rate=5, tracer=None, board=""):
+    log = f"Synthetic Thread [{board}]" if board else "Synthetic Thread"
+    generator = SyntheticFrameGenerator(width, height, channels, data_width)
+    rng = np.random.default_rng(seed)
+    min_chunk, max_chunk = chunk_size
+    print(f"{log}: {width}x{height}x{channels} {data_width}-bit frames, "
+          + (f"{fps} fps" if fps > 0 else "as fast as possible")
+          + f", chunks of {min_chunk}-{max_chunk} bytes, corruption rate {corruption}")
+
+    rx_bytes = metrics.meter(board_prefix(board) + "rx.bytes")
+    pending = bytearray()
+    next_chunk = int(rng.integers(min_chunk, max_chunk + 1))
+    corruptions = {}
+    start_time = time.monotonic()
+    last_printed_time = start_time
+    index = 0
+    while frames <= 0 or index < frames:
+        frame = generator.frame(index)
+        if corruption > 0 and rng.random() < corruption:
+            kind, frame = corrupt_frame(frame, rng)
+            corruptions[kind] = corruptions.get(kind, 0) + 1
+        pending += frame
+        index += 1
+
+        while len(pending) >= next_chunk:
+            chunk = bytes(pending[:next_chunk])
+            del pending[:next_chunk]
+            if tracer is not None:
+                tracer.chunk_received(chunk)
+            rx_binary_queue.put(chunk)
+            rx_bytes.mark(len(chunk))
+            next_chunk = int(rng.integers(min_chunk, max_chunk + 1))
+
+        if tx_binary_queue is not None:
+            discard_tx(tx_binary_queue, log)
+
+        now = time.monotonic()
+        if fps > 0:
+            delay = start_time + index / fps - now
+            if delay > 0:
+                time.sleep(delay)
+        if (now - last_printed_time) > stats_print_rate:
+            print(f"{log}: {index} frames generated, {index / (now - start_time):8.2f} fps, "
+                  f"corrupted {corruptions}")
+            last_printed_time = now
+
+    if pending:
+        rx_binary_queue.put(bytes(pending))
@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 
-import ftd2xx as ft
 import time
 import sys
 import numpy as np
@@ -13,60 +12,131 @@ import queue
 
 import argparse
 
-# New: Import PyQt for our GUI display
-from PyQt5 import QtWidgets, QtGui, QtCore
-
 # Import from our utils file in the same dir
+# (the GUI modules are only imported when a display is used, see --headless)
 from serialcam_stream_utils_ft232h import *
-from serialcam_ft232h_dialogs import *
+from serialcam_tracing_ft232h import make_tracer
+from serialcam_registers_ft232h import ShadowRegisterFile
+from serialcam_recorder_ft232h import FrameRecorder, make_pretrigger, install_trigger_signal
 
 import colormaps
 
+# Capture (reader + decoders) runs in its own process, frames reach this
+# process through shared memory
+def execute_multiprocess(args):
+    from PyQt5 import QtWidgets
+    from serialcam_display_ft232h import ImageDisplayWindow
+    from serialcam_multiprocess_ft232h import start_capture_process, SharedFrameReceiver
+    queue_config = stage_queue_config(args.queue)
+
+    # start capturing before any Qt state exists in this process
+    (capture_process, descriptor_queue, release_queue,
+     tx_binary_queue, recorder_request_queue, tx_unsent_queue) = start_capture_process(args)
+
+    display_queue = StageQueue(*queue_config["display"], name="display", on_drop=release_group)
+
+    app = QtWidgets.QApplication([])
+    app.setQuitOnLastWindowClosed(True)
+    registers = None if args.no_register_shadow else ShadowRegisterFile(unsent_queue=tx_unsent_queue)
+    window = ImageDisplayWindow(args.maxchannels, display_queue, recorder_request_queue, tx_binary_queue, args.fast,
+                                make_tracer(args), registers, args.display_fps, args.viewer,
+                                args.tiled)
+    install_trigger_signal(recorder_request_queue)
+
+    # Receives the frame descriptors from the capture process, along with
+    # its status line (the capture metrics live in the capture process), the
+    # display metrics of this process are appended to it
+    receiver = SharedFrameReceiver(descriptor_queue, release_queue, display_queue, window, args.fast)
+    window.set_status_source(lambda: " | ".join(
+        text for text in (receiver.status_text, format_status_line(metrics, capture=False)) if text))
+    receiver_thread = threading.Thread(target=receiver.run, daemon=True)
+    receiver_thread.start()
+
+    # Run the Qt displays in the main thread.
+    window.show()
+    app.exec_()
+    capture_process.terminate()
+
 def execute(args):
+    if args.headless:
+        from serialcam_headless_ft232h import execute_headless
+        return execute_headless(args)
+    if args.multiprocess:
+        if args.boards != 1:
+            raise SystemExit("--boards is not supported with --multiprocess")
+        return execute_multiprocess(args)
+
+    from PyQt5 import QtWidgets
+    from serialcam_display_ft232h import ImageDisplayWindow
+
     # Manually instantiate magic bytes
     magic_bytes = b'BIVFRAME'
+    queue_config = stage_queue_config(args.queue)
 
     # Initialize objects shared between threads
     # rx side
-    rx_binary_queue = queue.Queue()
-    rx_stream_queue = queue.Queue()
-    rx_channel_queues = []
-    for _ in range(args.maxchannels):
-        rx_channel_queues.append(queue.Queue())
+    rx_binary_queue = StageQueue(*queue_config["rx"], name="rx")
+    rx_stream_queue = StageQueue(*queue_config["stream"], name="stream")
+    display_queue = StageQueue(*queue_config["display"], name="display", on_drop=release_group)
 
-    # tx side
+    # tx side (the commands that could not be written come back on tx_unsent_queue)
     tx_binary_queue = queue.Queue()
+    tx_unsent_queue = queue.Queue()
     
     # Recording Utility 
-    recorder_request_queue = queue.Queue()
-    recorder_queues = []
-    for _ in range(args.maxchannels):
-        recorder_queues.append(queue.Queue())
+    # (captures are not supported with several boards: no request queue,
+    # which disables the capture actions of the window)
+    recorder_request_queue = None
+    if args.boards == 1:
+        recorder_request_queue = queue.Queue()
+        recorder = FrameRecorder(*queue_config["capture"], num_writers=args.capture_writers,
+                                 max_burst_bytes=args.burst_max_mb * 1024 * 1024).start()
+
+    # Per-frame latency tracing (None when off)
+    tracer = make_tracer(args)
     
     # Each channel gets a display window
     # The central channel controls the tx_binary_queue
     app = QtWidgets.QApplication([])
     app.setQuitOnLastWindowClosed(True)
-    window = ImageDisplayWindow(args.maxchannels, rx_channel_queues, recorder_request_queue, tx_binary_queue, args.fast)
-
-    # FT232 Threads
-    ft232h_thread = threading.Thread(target=ft232h,
-                                     args=(rx_binary_queue, tx_binary_queue, args.ftdi_sn_prefix.encode('utf-8'), args.fast),
-                                     daemon=True) 
-    # binary decoder
-    binary_decoder = BinaryDecoder(rx_binary_queue, rx_stream_queue, magic_bytes)
-    binary_decoder_thread = threading.Thread(target=binary_decoder.run,
-                                             daemon=True)
-
-    # stream decoder
-    stream_decoder = StreamDecoder(rx_stream_queue, rx_channel_queues, window, recorder_queues, recorder_request_queue, args.fast)
-    stream_decoder_thread = threading.Thread(target=stream_decoder.run,
-                                             daemon=True)
-
-    # Starting All Threads
-    ft232h_thread.start()
-    binary_decoder_thread.start()
-    stream_decoder_thread.start()
+    registers = None if args.no_register_shadow else ShadowRegisterFile(unsent_queue=tx_unsent_queue)
+    window = ImageDisplayWindow(args.maxchannels, display_queue, recorder_request_queue, tx_binary_queue, args.fast, tracer,
+                                registers, args.display_fps, args.viewer,
+                                args.tiled)
+
+    if args.boards != 1:
+        # every board has its own reader and decoders, the aligned frame
+        # groups are displayed with the channels of board 0 first
+        from serialcam_multiboard_ft232h import start_multiboard, publish_group
+        crop = display_crop(args.fast)
+        def show_group(group):
+            publish_group(display_queue, group, crop)
+            window.new_image_received.emit()
+        start_multiboard(args, tx_binary_queue, show_group, tracer, tx_unsent_queue)
+    else:
+        # FT232 Threads
+        ft232h_thread = threading.Thread(target=make_source(args, tracer, tx_unsent_queue=tx_unsent_queue),
+                                         args=(rx_binary_queue, tx_binary_queue),
+                                         daemon=True) 
+        # binary decoder
+        binary_decoder = BinaryDecoder(rx_binary_queue, rx_stream_queue, magic_bytes, args.max_backlog_mb * 1024 * 1024, args.framing,
+                                       tracer)
+        binary_decoder_thread = threading.Thread(target=binary_decoder.run,
+                                                 daemon=True)
+
+        # stream decoder
+        stream_decoder = StreamDecoder(rx_stream_queue, display_queue, window, recorder, recorder_request_queue, args.fast, args.frame_pool_size,
+                                       tracer=tracer, pretrigger=make_pretrigger(args))
+        stream_decoder_thread = threading.Thread(target=stream_decoder.run,
+                                                 daemon=True)
+        install_trigger_signal(recorder_request_queue)
+
+        # Starting All Threads
+        ft232h_thread.start()
+        binary_decoder_thread.start()
+        stream_decoder_thread.start()
+    start_metrics_writer(args)
+    window.set_status_source(lambda: format_status_line(metrics))
 
     # Run the Qt displays in the main thread.
     window.show()
@@ -82,6 +152,84 @@ if __name__ == '__main__':
     parser.add_argument("--centralchannel", type=int, default=0)
     parser.add_argument("--ftdi_sn_prefix", type=str, default="fsplit")
     parser.add_argument("--fast", type=int, default=False)
+    parser.add_argument("--viewer", type=str, default=None, choices=["matplotlib", "cv2", "qt"],
+                        help="channel viewer backend (default: cv2 with --fast, matplotlib otherwise). "
+                             "qt paints the colorized frames in Qt widgets without copying them")
+    parser.add_argument("--tiled", action="store_true",
+                        help="show every channel in one viewer, tiled into a canvas drawn once per refresh")
+    parser.add_argument("--boards", type=int, default=1,
+                        help="number of boards to capture from, 0 opens every FT232H matching --ftdi_sn_prefix "
+                             "(with --synthetic: number of simulated boards). Frames of the boards are grouped by arrival time")
+    parser.add_argument("--merge_tolerance_ms", type=float, default=5,
+                        help="multi-board: max difference between the arrival times of the frames of a group")
+    parser.add_argument("--usb_reads", type=str, default="adaptive", choices=["adaptive", "fixed"],
+                        help="adaptive: size reads, timeouts and the USB transfer size from the frame length and the device queue, "
+                             "fixed: 1MB reads with fixed timeouts")
+    parser.add_argument("--display_fps", type=float, default=30,
+                        help="max display refresh rate, only the newest frame is drawn at each refresh "
+                             "(0 redraws on every new frame, still skipping frames that queued up)")
+    parser.add_argument("--max_backlog_mb", type=int, default=64,
+                        help="max undecoded bytes (in MB) buffered by the binary decoder; oldest bytes are dropped past this")
+    parser.add_argument("--frame_pool_size", type=int, default=16,
+                        help="number of preallocated frame buffers shared by the decoder, viewer and recorder")
+    parser.add_argument("--framing", type=str, default="header", choices=["header", "marker"],
+                        help="header: cut frames using the payload length from the header, marker: wait for the next magic bytes")
+    parser.add_argument("--queue", type=str, action="append",
+                        help="size and overflow policy of a stage queue as stage:size:policy, e.g. display:4:drop-oldest "
+                             "(stages: rx, stream, display, record, capture; policies: drop-oldest, block, drop-newest). Can be repeated")
+    parser.add_argument("--capture_writers", type=int, default=2,
+                        help="number of threads encoding and writing the frames of the Capture dialog")
+    parser.add_argument("--burst_max_mb", type=int, default=2048,
+                        help="max memory (in MB) reserved for a multi-frame capture, longer bursts are shortened")
+    parser.add_argument("--pretrigger_s", type=float, default=0,
+                        help="keep the frames of the last N seconds in memory, File > Trigger Capture (ctrl+T) or SIGUSR1 "
+                             "writes them as raw files along with the frames of the next --posttrigger_s seconds (0: off)")
+    parser.add_argument("--posttrigger_s", type=float, default=2,
+                        help="seconds of frames written after a trigger")
+    parser.add_argument("--pretrigger_mb", type=int, default=1024,
+                        help="max memory (in MB) of the pre-trigger ring, which is otherwise sized for "
+                             "pretrigger_s + posttrigger_s of frames at the measured frame rate")
+    parser.add_argument("--multiprocess", action="store_true",
+                        help="run the FT232H reader and decoders in a separate process, frames are shared through shared memory")
+    parser.add_argument("--headless", action="store_true",
+                        help="no display (Qt and matplotlib are not imported), decoded frames are written straight to disk")
+    parser.add_argument("--output", type=str, default="capture/headless",
+                        help="headless: path prefix of the raw frame files")
+    parser.add_argument("--duration", type=float, default=0,
+                        help="headless: capture duration in seconds (0 runs until ctrl-c)")
+    parser.add_argument("--summary_period", type=float, default=5,
+                        help="headless: seconds between throughput and drop summaries")
+    parser.add_argument("--record_raw", type=str, default=None,
+                        help="also record the raw byte stream read from the FT232H (with chunk boundaries and timestamps) to this file")
+    parser.add_argument("--replay", type=str, default=None,
+                        help="replay a raw stream recording (see --record_raw) instead of reading from an FT232H")
+    parser.add_argument("--replay_speed", type=float, default=1.0,
+                        help="replay speed as a multiple of the recorded rate, 0 replays as fast as possible")
+    parser.add_argument("--replay_loop", action="store_true",
+                        help="restart the replay when the end of the recording is reached")
+    parser.add_argument("--synthetic", action="store_true",
+                        help="generate a synthetic BIVFRAME stream (--width x --height x --maxchannels) instead of reading from an FT232H")
+    parser.add_argument("--synthetic_data_width", type=int, default=16,
+                        help="synthetic: bits per sample")
+    parser.add_argument("--synthetic_fps", type=float, default=0,
+                        help="synthetic: frame rate, 0 generates as fast as the decoders keep up")
+    parser.add_argument("--synthetic_chunk", type=str, default="65536:1048576",
+                        help="synthetic: min:max size in bytes of the chunks, chunks split frames and headers at random")
+    parser.add_argument("--synthetic_corruption", type=float, default=0.0,
+                        help="synthetic: probability for each frame to be corrupted (bit flip, truncation, bad magic, junk)")
+    parser.add_argument("--trace", action="store_true",
+                        help="trace the latency of every frame through the pipeline and print rolling p50/p95/p99 per stage")
+    parser.add_argument("--trace_dump", type=str, default=None,
+                        help="append every frame trace (JSON lines) to this file, implies --trace")
+    parser.add_argument("--trace_window", type=int, default=1000,
+                        help="number of frames the latency percentiles are computed over")
+    parser.add_argument("--no_register_shadow", action="store_true",
+                        help="send every register write, even the ones that don't change the value last sent")
+    parser.add_argument("--metrics_file", type=str, default=None,
+                        help="periodically write a snapshot of the capture metrics to this file (JSON if it ends with .json, "
+                             "'name value' lines otherwise)")
+    parser.add_argument("--metrics_period", type=float, default=5,
+                        help="seconds between two writes of --metrics_file")
     args = parser.parse_args()
     execute(args)
 
@@ -1,77 +1,269 @@
 
-import ftd2xx as ft
+# Capture side of the serialcam tool (FT232H reader, decoders, frame pool and
+# stage queues). This module must not import Qt or matplotlib so it can be used
+# headless, the GUI lives in serialcam_display_ft232h.py
+try:
+    import ftd2xx as ft
+except ImportError:
+    # only needed to talk to a board, replays work without the D2XX driver
+    ft = None
 import time
 import sys
 import numpy as np
-import cv2
-from collections import deque
 import queue
-from serialcam_ft232h_dialogs import *
-import colormaps
+import threading
 import math
-from live_image_viewer import LiveImageViewer
-import matplotlib.pyplot as plt
-plt.ion()
-plt.show(block=False)
+from functools import partial
+from serialcam_sources_ft232h import RawStreamWriter, replay_source, synthetic_source
+from serialcam_metrics_ft232h import metrics, MetricsFileWriter, board_prefix
+from serialcam_registers_ft232h import COMMAND_PACKET
 
 def printhex(arr):
     hex_vals = [f"{val:02x}" for val in arr]
     for i in range(0, len(hex_vals), 8):
         print(" ".join(hex_vals[i:i+8]))
 
-# BIG-ENDIAN, combine bytes
-def combine_bytes(np_arr, data_width):
-    cols = np_arr.shape[1]
-    shifts = data_width * np.arange(cols - 1, -1, -1)  # e.g., [24, 16, 8, 0] for 4 bytes
-    return np_arr.astype(int) @ (1 << shifts)
+# BIG-ENDIAN, returns (dtype, unpack) where unpack(stream_np, out) writes the
+# samples of data_width bits contained in the uint8 stream into the native
+# byte order array out (of the returned dtype). Specialized per data_width:
+#   8          -> a plain copy
+#   16/32/64   -> a '>uN' view of the stream, byteswapped while copying into out
+#   24, 40 ... -> each sample is zero padded to the next power of two bytes
+#                 then viewed as '>uN'
+def make_sample_unpacker(data_width):
+    nbytes = data_width // 8
+    if data_width <= 0 or data_width % 8 != 0 or nbytes > 8:
+        raise ValueError(f"Unsupported data width {data_width}")
+
+    if nbytes in (1, 2, 4, 8):
+        big_endian = np.dtype(f">u{nbytes}")
+        native     = np.dtype(f"=u{nbytes}")
+        def unpack(stream_np, out):
+            np.copyto(out.reshape(-1), stream_np.view(big_endian))
+            return out
+        return native, unpack
+
+    padded_nbytes = 1 << (nbytes - 1).bit_length()
+    big_endian = np.dtype(f">u{padded_nbytes}")
+    native     = np.dtype(f"=u{padded_nbytes}")
+    def unpack(stream_np, out):
+        samples = stream_np.reshape(-1, nbytes)
+        padded = np.zeros((len(samples), padded_nbytes), dtype=np.uint8)
+        padded[:, padded_nbytes - nbytes:] = samples
+        np.copyto(out.reshape(-1), padded.view(big_endian).reshape(-1))
+        return out
+    return native, unpack
+
+# Region of each channel handed to the display, as (row, col) slices
+def display_crop(fast):
+    # if fast, cropping a 490x450 image
+    if fast:
+        return (slice(0, 400), slice(0, 480))
+    return (slice(15, 415), slice(5, 485))
+
+# Tiles the channels of a frame group into fixed slots of one persistent
+# canvas. The grid is ceil(sqrt(n)) columns wide with as many rows as needed;
+# the canvas and the slot views into it are kept until the number, shape or
+# dtype of the channels change, so tiling a group is one copy per channel.
+class TileCanvas:
+    def __init__(self, fill_value=0):
+        self.fill_value = fill_value
+        self.canvas = None
+        self.slots = []
+        self.key = None
+
+    def layout(self, n, shape, dtype):
+        """
+        (Re)allocates the canvas for n channels of the given shape and dtype,
+        returns True if the layout changed.
+        """
+        key = (n, tuple(shape), np.dtype(dtype))
+        if key == self.key:
+            return False
+        h, w = shape
+        cols = math.ceil(math.sqrt(n))
+        rows = math.ceil(n / cols)
+        self.canvas = np.full((rows * h, cols * w), self.fill_value, dtype=dtype)
+        self.slots = [self.canvas[(i // cols) * h:(i // cols + 1) * h, (i % cols) * w:(i % cols + 1) * w]
+                      for i in range(n)]
+        self.key = key
+        return True
+
+    def update(self, arrays):
+        """
+        Copies the 2D arrays (same shape) into their slots, returns the canvas.
+        """
+        if not arrays:
+            return None
+        self.layout(len(arrays), arrays[0].shape, arrays[0].dtype)
+        for slot, arr in zip(self.slots, arrays):
+            np.copyto(slot, arr)
+        return self.canvas
 
 def tile_arrays(arrays, fill_value=0):
     """
     Take a list of 2D NumPy arrays (same shape) and tile them
-    into a square grid. Empty slots are filled with fill_value.
+    into a new grid. Empty slots are filled with fill_value.
+    Use a TileCanvas to tile repeatedly into the same buffer.
     """
     if not arrays:
         return None
+    return TileCanvas(fill_value).update(arrays)
+
+
+
+# Chooses the size and timeout of every ftdev.read() and the USB transfer size,
+# from the length of the frames being received (the "framing.frame_bytes"
+# metric set by the BinaryDecoder), the data rate and the number of bytes
+# already queued in the device (getQueueStatus):
+#   - if at least a read's worth of data is queued, it is all read right away
+#     (up to MAX_READ), nothing to wait for
+#   - otherwise a quarter of a frame is requested, with a timeout of about
+#     1.5x the time the missing bytes take to arrive at the current rate. The
+#     decoder gets frames in a few pieces instead of waiting for a 1MB buffer
+#     to fill, without the tiny chunks a short fixed timeout gives.
+#   - the USB transfer size follows the frame length (bigger transfers for
+#     bigger frames, smaller ones so small frames are not held back)
+class AdaptiveReadPolicy:
+    MIN_READ          = 4 * 1024
+    MAX_READ          = 4 * 1024 * 1024
+    DEFAULT_READ      = 64 * 1024  # until a frame was received
+    MIN_TRANSFER_SIZE = 4 * 1024
+    MAX_TRANSFER_SIZE = 64 * 1024
+
+    def __init__(self, fast=False, frame_len_fn=None, rate_fn=None, board=""):
+        self.min_timeout_ms = 2 if fast else 5
+        self.max_timeout_ms = 20 if fast else 100
+        prefix = board_prefix(board)
+        self.frame_len_fn = frame_len_fn or metrics.gauge(prefix + "framing.frame_bytes").snapshot
+        rx_bytes = metrics.meter(prefix + "rx.bytes")
+        self.rate_fn = rate_fn or (lambda: rx_bytes.ewma.value())
+
+    def target_read_size(self):
+        frame_len = self.frame_len_fn()
+        if frame_len <= 0:
+            return self.DEFAULT_READ
+        return min(max(frame_len // 4, self.MIN_READ), self.MAX_READ)
+
+    def next_read(self, queued):
+        """
+        Returns (read size, read timeout in ms) given the number of bytes queued in the device.
+        """
+        target = self.target_read_size()
+        if queued >= target:
+            return min(queued, self.MAX_READ), self.min_timeout_ms
+        rate = self.rate_fn()
+        if rate <= 0:
+            return target, self.max_timeout_ms
+        timeout_ms = 1.5 * (target - queued) / rate * 1000
+        return target, int(min(max(timeout_ms, self.min_timeout_ms), self.max_timeout_ms))
+
+    def transfer_size(self):
+        """
+        USB transfer size: about 1/16th of a frame, a power of two between 4KB and 64KB.
+        """
+        frame_len = self.frame_len_fn()
+        if frame_len <= 0:
+            return self.MAX_TRANSFER_SIZE
+        size = 1 << max(frame_len // 16, 1).bit_length() - 1
+        return min(max(size, self.MIN_TRANSFER_SIZE), self.MAX_TRANSFER_SIZE)
+
+# Sends the command packets put on tx_binary_queue to the FPGA from its own
+# thread, so commands neither wait for a USB read to finish nor delay one.
+# Every packet pending when the thread wakes up is concatenated into a
+# single ftdev.write (up to max_batch bytes), a whole homography or DfDD
+# parameter block therefore goes out in one USB transfer.
+#
+# When a write stalls, the rest of the batch is dropped and put on
+# unsent_queue (from the first packet not fully written), so the register
+# shadow doesn't take those values as written.
+class TxScheduler:
+    def __init__(self, ftdev, tx_binary_queue, max_batch=64 * 1024, board="", unsent_queue=None):
+        self.ftdev           = ftdev
+        self.tx_binary_queue = tx_binary_queue
+        self.unsent_queue    = unsent_queue
+        self.max_batch       = max_batch
+        self.log             = f"TX Thread [{board}]" if board else "TX Thread"
+        prefix = board_prefix(board)
+        self.batches_meter   = metrics.meter(prefix + "tx.batches")
+        self.packets_meter   = metrics.meter(prefix + "tx.packets")
+        self.bytes_meter     = metrics.meter(prefix + "tx.bytes")
+        self.write_timer     = metrics.timer(prefix + "tx.write_time")
+        self.stalls          = metrics.counter(prefix + "tx.stalls")
 
-    h, w = arrays[0].shape
-    n = len(arrays)
-    grid_size = math.ceil(math.sqrt(n))
-
-    # Create big array initialized with fill_value
-    big = np.full((grid_size * h, grid_size * w), fill_value, dtype=arrays[0].dtype)
-
-    for idx, arr in enumerate(arrays):
-        row = idx // grid_size
-        col = idx % grid_size
-        big[row*h:(row+1)*h, col*w:(col+1)*w] = arr
-
-    return big
-
-
+    def run(self):
+        while True:
+            batch = [self.tx_binary_queue.get()]
+            nbytes = len(batch[0])
+            while nbytes < self.max_batch:
+                try:
+                    packet = self.tx_binary_queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(packet)
+                nbytes += len(packet)
+            self.send(b"".join(batch), len(batch))
+
+    def send(self, data, packets):
+        start = time.perf_counter()
+        written = 0
+        while written < len(data):
+            n = self.ftdev.write(data[written:])
+            if not n:
+                # write timeout or stalled device, give up on the rest of the batch
+                self.stalls.inc()
+                print(f"{self.log}: {time.strftime('%H:%M:%S')} write stalled, "
+                      f"{len(data) - written} of {len(data)} bytes not sent")
+                if self.unsent_queue is not None:
+                    self.unsent_queue.put(data[written - written % COMMAND_PACKET.size:])
+                return
+            written += n
+        elapsed = time.perf_counter() - start
+        self.batches_meter.mark()
+        self.packets_meter.mark(packets)
+        self.bytes_meter.mark(len(data))
+        self.write_timer.observe(elapsed)
+        print(f"{self.log}: {time.strftime('%H:%M:%S')} sent {packets} packets ({len(data)} bytes) "
+              f"to FPGA in {elapsed * 1e3:.2f}ms")
 
 # Sends and Recieves binary data from FT232h chip
-def ft232h(rx_binary_queue, tx_binary_queue, sn_prefix=b'fsplit', fast=0):
+# If raw_record_path is given, every chunk read is also recorded there
+# (see serialcam_sources_ft232h.py for the format).
+# Commands are sent by a TxScheduler thread.
+# With adaptive_reads, read sizes, timeouts and the USB transfer size are
+# chosen by an AdaptiveReadPolicy, otherwise reads are fixed 1MB reads.
+# The first device whose serial number starts with sn_prefix is opened,
+# unless a serial_number is given (multi-board captures, where 'board' names
+# the board in the logs and metrics).
+def ft232h(rx_binary_queue, tx_binary_queue, sn_prefix=b'fsplit', fast=0, raw_record_path=None, tracer=None,
+           adaptive_reads=True, serial_number=None, board="", tx_unsent_queue=None):
+    log = f"Read Thread [{board}]" if board else "Read Thread"
+    prefix = board_prefix(board)
+    if ft is None:
+        raise RuntimeError(f"{log}: the ftd2xx module is required to read from an FT232H board")
     # Find the ftdi device to open
     try:
         devlist = ft.listDevices()
-        print(f"Read Thread: Found FT232H devices with the following serial numbers:")
+        print(f"{log}: Found FT232H devices with the following serial numbers:")
         print(devlist)
         matching_sns = [sn for sn in devlist if (sn.startswith(sn_prefix))]
+        if serial_number is not None:
+            matching_sns = [sn for sn in devlist if sn == serial_number]
         if (len(matching_sns) == 0):
-            print(f"Read Thread: Couldn't find an FT232H board with a serial number starting with {sn_prefix}")
+            print(f"{log}: Couldn't find an FT232H board with a serial number starting with {sn_prefix}")
             sys.exit(-1)
         else:
             ftdev_id = devlist.index(matching_sns[0])
-            print(f"Read Thread: Choosing device number {ftdev_id} with serial number {matching_sns[0]}")
+            print(f"{log}: Choosing device number {ftdev_id} with serial number {matching_sns[0]}")
     except ValueError:
-        raise Exception("Read Thread: No board found!")
+        raise Exception(f"{log}: No board found!")
 
     # open and configure the device
-    print("Read Thread: Opening device")
+    print(f"{log}: Opening device")
     ftdev = ft.open(ftdev_id)
-    print("Read Thread: resetting device")
+    print(f"{log}: resetting device")
     ftdev.resetDevice()
-    print("Read Thread: setting modes")
+    print(f"{log}: setting modes")
     ftdev.setBitMode(0xff, 0x00)
     if(fast):
         ftdev.setTimeouts(5,5)
@@ -81,39 +273,229 @@ def ft232h(rx_binary_queue, tx_binary_queue, sn_prefix=b'fsplit', fast=0):
     ftdev.setUSBParameters(64 * 1024, 64 * 1024)  # set rx, tx buffer size in bytes
     ftdev.setFlowControl(ft.defines.FLOW_RTS_CTS, 0, 0)
 
+    # commands go out from their own thread
+    threading.Thread(target=TxScheduler(ftdev, tx_binary_queue, board=board, unsent_queue=tx_unsent_queue).run,
+                     daemon=True).start()
+
+    read_policy = AdaptiveReadPolicy(fast, board=board) if adaptive_reads else None
+    read_size = 1024 * 1024
+    read_timeout_ms = 5 if fast else 100
+    transfer_size = 64 * 1024
+    metrics.gauge(prefix + "rx.read_size", lambda: read_size)
+    metrics.gauge(prefix + "rx.read_timeout_ms", lambda: read_timeout_ms)
+    metrics.gauge(prefix + "rx.usb_transfer_size", lambda: transfer_size)
+    rx_reads = metrics.meter(prefix + "rx.reads")
+
+    raw_writer = None
+    if raw_record_path:
+        raw_writer = RawStreamWriter(raw_record_path, board=board)
+        print(f"{log}: recording the raw stream to {raw_record_path}")
+
     # Read data
-    stats = DataRateStats()
-    last_printed_time = time.time()
+    rx_bytes = metrics.meter(prefix + "rx.bytes")
+    last_printed_time = time.monotonic()
     STATS_PRINT_RATE = 5
     while True:
+        if read_policy is not None:
+            # the USB transfer size only changes with the frame size
+            if read_policy.transfer_size() != transfer_size:
+                transfer_size = read_policy.transfer_size()
+                ftdev.setUSBParameters(transfer_size, 64 * 1024)
+                print(f"{log}: USB transfer size set to {transfer_size // 1024}KB")
+            read_size, timeout_ms = read_policy.next_read(ftdev.getQueueStatus())
+            # setting the timeouts is a driver call, skip small changes
+            if abs(timeout_ms - read_timeout_ms) > read_timeout_ms // 4:
+                read_timeout_ms = timeout_ms
+                ftdev.setTimeouts(read_timeout_ms, 100)
+
         # Try to read from the ft232; send the resulting data to stream decoder thread
-        chunk = ftdev.read(1024 * 1024)
+        chunk = ftdev.read(read_size)
+        rx_reads.mark()
+        if tracer is not None:
+            tracer.chunk_received(chunk)
         rx_binary_queue.put(chunk)
+        if raw_writer is not None and chunk:
+            raw_writer.write(chunk)
         # update data reading stats
-        stats.register_bytes_read(len(chunk))
-        # Check tx_binary queue to see if we need to send data
-        try:
-            txdata = tx_binary_queue.get_nowait()
-            print(f"sending {txdata} to FPGA")
-            ftdev.write(txdata)
-        except queue.Empty as e:
-            pass
-            
+        rx_bytes.mark(len(chunk))
 
         # print data rate if we havent printed in a little bit
-        if ((time.time() - last_printed_time) > STATS_PRINT_RATE):
-            data_rate, total_datas = stats.get_results()
-            print(f"Read Thread: reading data at {data_rate/1e6:6.2f}MB/s. {total_datas/1e6:8.2}MB so far")
-            last_printed_time = time.time()
+        if ((time.monotonic() - last_printed_time) > STATS_PRINT_RATE):
+            reads_per_s = rx_reads.window.rate()
+            chunk_size = rx_bytes.window.rate() / reads_per_s if reads_per_s > 0 else 0
+            print(f"{log}: reading data at {rx_bytes.window.rate()/1e6:6.2f}MB/s. {rx_bytes.total/1e6:8.2f}MB so far | "
+                  f"{reads_per_s:7.1f} reads/s of {chunk_size/1024:8.1f}KB on average (asking for {read_size/1024:.0f}KB, "
+                  f"timeout {read_timeout_ms}ms, USB transfer size {transfer_size // 1024}KB)")
+            last_printed_time = time.monotonic()
+
+# Returns the byte stream source selected by the command line arguments,
+# called as source(rx_binary_queue, tx_binary_queue)
+# In multi-board captures, board names the source, serial_number selects the
+# FT232H and channels is the number of channels of a synthetic board.
+# The commands an FT232H could not write are put on tx_unsent_queue (if given).
+def make_source(args, tracer=None, board="", serial_number=None, channels=None, seed=0, tx_unsent_queue=None):
+    if args.replay:
+        return partial(replay_source, path=args.replay, speed=args.replay_speed, loop=args.replay_loop,
+                       tracer=tracer)
+    if args.synthetic:
+        min_chunk, max_chunk = (int(n) for n in args.synthetic_chunk.split(":"))
+        return partial(synthetic_source, width=args.width, height=args.height,
+                       channels=channels if channels is not None else args.maxchannels,
+                       data_width=args.synthetic_data_width, fps=args.synthetic_fps,
+                       chunk_size=(min_chunk, max_chunk), corruption=args.synthetic_corruption, seed=seed,
+                       tracer=tracer, board=board)
+    raw_record_path = args.record_raw
+    if raw_record_path and board:
+        raw_record_path = f"{raw_record_path}.{board}"
+    return partial(ft232h, sn_prefix=args.ftdi_sn_prefix.encode('utf-8'), fast=args.fast,
+                   raw_record_path=raw_record_path, tracer=tracer, adaptive_reads=(args.usb_reads == "adaptive"),
+                   serial_number=serial_number, board=board, tx_unsent_queue=tx_unsent_queue)
+
+# Growable byte buffer with a read cursor, used to accumulate the raw
+# USB chunks until complete frames can be cut out of them.
+#
+# Received bytes are copied into the backing bytearray exactly once; the
+# unread region is only moved back to the front of the buffer when the
+# write cursor reaches the end (which in steady state is less than one
+# frame of data).
+#
+# Drop policy: the buffer never grows past max_size bytes. If appending
+# a chunk would exceed it, the OLDEST unread bytes are discarded to make
+# room (the newest data is always kept). Dropping bytes breaks framing:
+# append() returns the number of bytes it dropped, and the decoder then
+# forgets the frame in progress and resynchronizes on the next magic marker.
+class ByteAccumulator:
+    def __init__(self, initial_size=4 * 1024 * 1024, max_size=64 * 1024 * 1024):
+        """
+        :param initial_size: initial capacity of the buffer in bytes.
+        :param max_size: maximum number of unread bytes held before the oldest are dropped.
+        """
+        self.max_size      = max_size
+        self.buf           = bytearray(min(initial_size, max_size))
+        self.start         = 0  # read cursor
+        self.end           = 0  # write cursor
+        self.dropped_bytes = 0
+        self.total_appended = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def append(self, chunk):
+        """
+        Appends a chunk, returns the number of bytes dropped to stay under max_size.
+        """
+        n = len(chunk)
+        if n == 0:
+            return 0
+        dropped = 0
+        # a single chunk larger than the limit only keeps its newest bytes
+        if n > self.max_size:
+            dropped += (self.end - self.start) + (n - self.max_size)
+            self.total_appended += n - self.max_size
+            chunk = memoryview(chunk)[n - self.max_size:]
+            n = self.max_size
+            self.start = self.end = 0
+        # drop the oldest unread bytes if we would go over the limit
+        overflow = (self.end - self.start) + n - self.max_size
+        if overflow > 0:
+            self.start += overflow
+            dropped += overflow
+        self.dropped_bytes += dropped
+        if self.end + n > len(self.buf):
+            self._make_room(n)
+        self.buf[self.end:self.end + n] = chunk
+        self.end += n
+        self.total_appended += n
+        return dropped
+
+    def stream_offset(self):
+        """
+        Returns the position of the read cursor in the whole received stream.
+        """
+        return self.total_appended - (self.end - self.start)
+
+    def consume(self, n):
+        """
+        Advance the read cursor by n bytes.
+        """
+        self.start = min(self.start + n, self.end)
+        if self.start == self.end:
+            self.start = self.end = 0
+
+    def view(self):
+        """
+        Returns a zero-copy uint8 view of the unread bytes. The view is
+        only valid until the next call to append().
+        """
+        return np.frombuffer(self.buf, dtype=np.uint8, count=self.end - self.start, offset=self.start)
+
+    def find(self, sub, start=0):
+        """
+        Returns the offset (relative to the read cursor) of the first occurrence
+        of sub at or after start, or -1. The search runs in C (bytearray.find).
+        """
+        index = self.buf.find(sub, self.start + start, self.end)
+        return -1 if index < 0 else index - self.start
+
+    def peek(self, offset, n):
+        """
+        Returns a copy of n unread bytes starting at offset.
+        """
+        return bytes(self.buf[self.start + offset:self.start + offset + n])
+
+    def _make_room(self, n):
+        unread = self.end - self.start
+        needed = unread + n
+        if needed > len(self.buf):
+            # grow by doubling, the drop policy guarantees needed <= max_size
+            new_size = len(self.buf)
+            while new_size < needed:
+                new_size *= 2
+            new_buf = bytearray(min(new_size, self.max_size))
+            new_buf[0:unread] = memoryview(self.buf)[self.start:self.end]
+            self.buf = new_buf
+        else:
+            # move the unread bytes to the front of the buffer
+            with memoryview(self.buf) as mv:
+                mv[0:unread] = mv[self.start:self.end]
+        self.start, self.end = 0, unread
 
 # Form complete frames (streams) from the rx_binary_queue
+#
+# Two framing modes are supported:
+#   "marker": a frame is complete once the magic bytes of the NEXT frame
+#             are found, so frames are delayed by one frame and every payload
+#             byte is scanned.
+#   "header": the payload length is computed from the header
+#             (width * height * channels * data_width / 8), the frame is sent
+#             as soon as its payload is there, without waiting for the next
+#             frame. The magic bytes are only checked at the expected position
+#             when the next header is parsed, if they aren't there we fall back
+#             to scanning for them (a resync, counted in framing.resyncs).
 class BinaryDecoder:
-    def __init__(self, rx_binary_queue, rx_stream_queue, magic_bytes):
+    def __init__(self, rx_binary_queue, rx_stream_queue, magic_bytes, max_backlog=64 * 1024 * 1024, framing="header",
+                 tracer=None, board=""):
         self.magic_bytes        = magic_bytes
         self.magic_bytes_np     = np.frombuffer(magic_bytes, dtype=np.uint8)
         
         self.rx_binary_queue    = rx_binary_queue
         self.rx_stream_queue    = rx_stream_queue
+        self.framing            = framing
+        self.tracer             = tracer
+        self.frame_trace        = None
+        self.board              = board
+        # when the chunk being decoded was taken from rx_binary_queue, this is
+        # the arrival time of the frames it completes
+        self.chunk_time         = 0.0
+        # chunks dropped by rx_binary_queue so far (with a drop policy set by
+        # --queue), a drop breaks the framing like a backlog overflow; the
+        # checks of the next magic bytes and of the payload length then catch
+        # the frame spanning the gap
+        self.rx_dropped         = 0
+
+        # Accumulates received bytes until a full frame is available,
+        # at most max_backlog bytes are kept (oldest are dropped first)
+        self.acc = ByteAccumulator(max_size=max_backlog)
         
         # Header Info stored in BIG-ENDIAN (wrt to array index, meaning,
         # low index is MSB and high index is LSB) then passed as metadata:
@@ -125,77 +507,480 @@ class BinaryDecoder:
         self.magic_bytes_len_np = len(self.magic_bytes_np)
         # includes width, height and data_width bytes (2 + 2 + 1 + 1 = 6)
         self.magic_bytes_len_total_np = self.magic_bytes_len_np + 6
+
+        # Header of the frame whose magic bytes sit at the front of the
+        # accumulator, None while we are not synchronized to the stream
+        self.header_info = None
+        # Offset (relative to the front of the accumulator) where the next
+        # search for magic bytes resumes
+        self.scan_pos = 0
+        # Number of times the magic bytes weren't where the header said they would be
+        self.resyncs = 0
+        self.in_sync = False
+
+        prefix = board_prefix(board)
+        self.frames_meter = metrics.meter(prefix + "framing.frames")
+        # length (header included) of the last frame, used to size the USB reads
+        self.frame_bytes = metrics.gauge(prefix + "framing.frame_bytes")
+        self.framing_timer = metrics.timer(prefix + "framing.time")
+        metrics.gauge(prefix + "framing.resyncs", lambda: self.resyncs)
+        metrics.gauge(prefix + "framing.backlog_bytes", lambda: len(self.acc))
+        metrics.gauge(prefix + "framing.dropped_bytes", lambda: self.acc.dropped_bytes)
    
     def run(self):
-        rx_binary_acc_np = np.empty((0,), dtype=np.uint8)
+        while True:
+            chunk = self.rx_binary_queue.get()
+            self.chunk_time = time.monotonic()
+            start = time.perf_counter()
+            rx_dropped = getattr(self.rx_binary_queue, "dropped", 0)
+            if rx_dropped != self.rx_dropped:
+                self.rx_dropped = rx_dropped
+                self.lose_sync()
+            if self.acc.append(chunk) > 0:
+                self.lose_sync()
+            if self.tracer is not None:
+                self.tracer.chunk_decoded(chunk, self.acc.total_appended, self.board)
+            self.extract_frames()
+            self.framing_timer.observe(time.perf_counter() - start)
+
+    def extract_frames(self):
+        if self.framing == "header":
+            self.extract_frames_by_header()
+        else:
+            self.extract_frames_by_marker()
+
+    def extract_frames_by_header(self):
         mb_len       = self.magic_bytes_len_np
         mb_len_total = self.magic_bytes_len_total_np
         while True:
-            rx_binary_np = np.frombuffer(self.rx_binary_queue.get(), dtype=np.uint8)
-            rx_binary_acc_np = np.concatenate((rx_binary_acc_np, rx_binary_np))
-            matching_indices = self.find_magic_bytes(rx_binary_acc_np)
-            # we have a full frame, send as a tuple (header_info, data)
-            # then remove it from the accumulator
-            if(len(matching_indices) > 1):
-                stream = np.array(rx_binary_acc_np[matching_indices[0]+mb_len_total:matching_indices[1]],copy=True)
-                self.rx_stream_queue.put(
-                    ([self.width, self.height, self.channels, self.data_width],
-                     stream))
-                rx_binary_acc_np = rx_binary_acc_np[matching_indices[1]:]
-    
-    def find_magic_bytes(self, rx_binary_np_acc):
+            if self.header_info is None:
+                if len(self.acc) < mb_len_total:
+                    return
+                # the magic bytes are expected right at the front, otherwise resync
+                if self.acc.peek(0, mb_len) != self.magic_bytes:
+                    self.resync(1)
+                    continue
+                self.header_info = self.start_frame()
+                payload_len = self.payload_len(self.header_info)
+                # a corrupted header can't be trusted to find the next frame
+                if payload_len <= 0 or (mb_len_total + payload_len) > self.acc.max_size:
+                    self.header_info = None
+                    self.resync(1)
+                    continue
+                self.in_sync = True
+
+            frame_len = mb_len_total + self.payload_len(self.header_info)
+            if len(self.acc) < frame_len:
+                return
+            stream = np.array(self.acc.view()[mb_len_total:frame_len], copy=True)
+            self.send_frame(stream)
+            self.header_info = None
+            self.acc.consume(frame_len)
+
+    def lose_sync(self):
+        """
+        Forgets the frame in progress after bytes were dropped from the accumulator,
+        the next extract_frames() looks for magic bytes from the front again.
+        """
+        if self.in_sync:
+            self.resyncs += 1
+            self.in_sync = False
+        self.header_info = None
+        self.frame_trace = None
+        self.scan_pos    = 0
+
+    def resync(self, start):
+        """
+        Drops everything before the next magic bytes found at or after start.
+        If there are none yet, only the tail that could hold a partial marker is kept.
+        """
+        # only count losing sync, not every attempt at finding it again
+        if self.in_sync:
+            self.resyncs += 1
+            self.in_sync = False
+        index = self.find_magic_bytes(start)
+        if index < 0:
+            index = max(start, len(self.acc) - self.magic_bytes_len_np + 1)
+        self.acc.consume(index)
+
+    def payload_len(self, header_info):
+        width, height, channels, data_width = header_info
+        return width * height * channels * (data_width // 8)
+
+    def extract_frames_by_marker(self):
         mb_len       = self.magic_bytes_len_np
         mb_len_total = self.magic_bytes_len_total_np
-        candidates = np.flatnonzero(rx_binary_np_acc == self.magic_bytes_np[0])
-        matching_indices = []
-        for i in candidates:
-            if (i + mb_len_total) > len(rx_binary_np_acc):
-                break
-            if np.array_equal(rx_binary_np_acc[i : i + mb_len], self.magic_bytes_np):
-                width_msb  = rx_binary_np_acc[i + mb_len + 0]
-                width_lsb  = rx_binary_np_acc[i + mb_len + 1]
-                height_msb = rx_binary_np_acc[i + mb_len + 2]
-                height_lsb = rx_binary_np_acc[i + mb_len + 3]   
-                self.width      = (int(width_msb) << 8) + width_lsb
-                self.height     = (int(height_msb) << 8) + height_lsb
-                self.channels   = rx_binary_np_acc[i + mb_len + 4]
-                self.data_width = rx_binary_np_acc[i + mb_len + 5]
-                matching_indices.append(i)
-        return matching_indices
+        while True:
+            index = self.find_magic_bytes(self.scan_pos)
+            if index < 0:
+                # resume the next search after what was scanned, but keep enough of
+                # the tail for magic bytes that straddle two chunks
+                self.scan_pos = max(self.scan_pos, len(self.acc) - mb_len + 1)
+                if self.header_info is None:
+                    # not synchronized, nothing before the scan position is useful
+                    self.acc.consume(self.scan_pos)
+                    self.scan_pos = 0
+                return
+
+            # the previous frame ends where the next magic bytes start, send it as
+            # a tuple (header_info, data) then remove it from the accumulator
+            if self.header_info is not None:
+                stream = np.array(self.acc.view()[mb_len_total:index], copy=True)
+                self.send_frame(stream)
+                self.header_info = None
+            self.acc.consume(index)
+            self.scan_pos = 0
+
+            # wait for the rest of the header if it hasn't arrived yet
+            if len(self.acc) < mb_len_total:
+                return
+            self.header_info = self.start_frame()
+            self.scan_pos = mb_len_total
+
+    def start_frame(self):
+        """
+        Parses the header of the frame at the front of the accumulator.
+        """
+        if self.tracer is not None:
+            self.frame_trace = self.tracer.new_trace(self.acc.stream_offset(), self.board)
+        return self.parse_header(0)
+
+    def send_frame(self, stream):
+        """
+        Sends a frame as a tuple (header_info, data, trace, arrival time), trace is None when not tracing
+        """
+        if self.frame_trace is not None:
+            self.frame_trace.stamp("framed")
+        self.rx_stream_queue.put((self.header_info, stream, self.frame_trace, self.chunk_time))
+        self.frame_trace = None
+        self.frames_meter.mark()
+        self.frame_bytes.set(self.magic_bytes_len_total_np + len(stream))
+
+    def find_magic_bytes(self, start=0):
+        """
+        Returns the offset of the next magic bytes at or after start, or -1.
+        """
+        return self.acc.find(self.magic_bytes, start)
+
+    def parse_header(self, index):
+        """
+        Parses the 6 header bytes following the magic bytes at index.
+        """
+        header = self.acc.peek(index + self.magic_bytes_len_np, 6)
+        self.width      = (header[0] << 8) + header[1]
+        self.height     = (header[2] << 8) + header[3]
+        self.channels   = header[4]
+        self.data_width = header[5]
+        return [self.width, self.height, self.channels, self.data_width]
     
+# A frame buffer handed out by a FramePool. Buffers are reference counted:
+# the producer gets a buffer holding one reference, calls retain() once for
+# every consumer it hands the buffer to, and every consumer (as well as the
+# producer itself) calls release() when done. The last release returns the
+# buffer to its pool.
+class FrameBuffer:
+    def __init__(self, pool, array, generation):
+        self.pool       = pool
+        self.array      = array
+        self.generation = generation
+        self.refs       = 0
+        self.trace      = None
+        self.timestamp  = 0.0  # arrival time (time.monotonic) of the frame it holds
+
+    def retain(self, n=1):
+        self.pool._add_refs(self, n)
+
+    def release(self):
+        self.pool._add_refs(self, -1)
+
+# Fixed size pool of frame buffers, all with the same shape and dtype (sized
+# from the BIVFRAME header). When the shape changes, a new generation of
+# buffers is allocated; buffers of the old generation still in flight are
+# simply dropped when released.
+#
+# When no buffer is free, acquire() returns None and counts the miss in
+# 'exhausted' instead of allocating, the caller is expected to drop the frame.
+class FramePool:
+    def __init__(self, num_buffers=16):
+        self.num_buffers = num_buffers
+        self.shape       = None
+        self.dtype       = None
+        self.generation  = 0
+        self.free        = []
+        self.exhausted   = 0
+        self.lock        = threading.Lock()
+
+    def configure(self, shape, dtype):
+        """
+        (Re)allocates the buffers if shape or dtype changed.
+        """
+        shape = tuple(shape)
+        dtype = np.dtype(dtype)
+        with self.lock:
+            if shape == self.shape and dtype == self.dtype:
+                return
+            self.shape = shape
+            self.dtype = dtype
+            self.generation += 1
+            for frame in self.free:
+                self._discard(frame)
+            self.free = [self._new_buffer(shape, dtype) for _ in range(self.num_buffers)]
+
+    def acquire(self):
+        """
+        Returns a free FrameBuffer holding one reference, or None if the pool is exhausted.
+        """
+        with self.lock:
+            if not self.free:
+                self.exhausted += 1
+                return None
+            frame = self.free.pop()
+            frame.refs = 1
+            frame.trace = None
+            frame.timestamp = 0.0
+            return frame
+
+    def available(self):
+        with self.lock:
+            return len(self.free)
+
+    def _add_refs(self, frame, n):
+        with self.lock:
+            frame.refs += n
+            if frame.refs == 0:
+                if frame.generation == self.generation:
+                    self.free.append(frame)
+                else:
+                    self._discard(frame)
+
+    # Overridden by pools whose buffers don't live in ordinary process memory
+    def _new_buffer(self, shape, dtype):
+        return FrameBuffer(self, np.empty(shape, dtype=dtype), self.generation)
+
+    def _discard(self, frame):
+        pass
+
+# Release the frame buffer (if any) referenced by a channel package:
+# (header_info, data, frame_buffer)
+def release_package(pkg):
+    if len(pkg) > 2 and pkg[2] is not None:
+        pkg[2].release()
+
+# Release every package of a channel group (a list of channel packages)
+def release_group(group):
+    for pkg in group:
+        release_package(pkg)
+
+# A bounded queue between two capture stages, with an overflow policy:
+#   "drop-oldest": the oldest queued item is discarded to make room (display)
+#   "block":       put() waits until there is room (recording)
+#   "drop-newest": the item being put is discarded (analysis)
+# Discarded items are counted in 'dropped' and handed to on_drop (used to give
+# frame buffers back to their pool).
+# Named queues publish their depth and drop count as the metrics
+# "queue.<name>.depth" and "queue.<name>.dropped".
+class StageQueue(queue.Queue):
+    POLICIES = ("drop-oldest", "block", "drop-newest")
+
+    def __init__(self, maxsize=0, policy="block", name="", on_drop=None):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown queue policy {policy}")
+        super().__init__(maxsize)
+        self.policy  = policy
+        self.name    = name
+        self.on_drop = on_drop
+        self.dropped = 0
+        if name:
+            metrics.gauge(f"queue.{name}.depth", self.qsize)
+            metrics.gauge(f"queue.{name}.dropped", lambda: self.dropped)
+
+    def put(self, item, block=True, timeout=None):
+        if self.policy == "block":
+            return super().put(item, block, timeout)
+
+        dropped, dropped_item = False, None
+        with self.not_full:
+            if self.maxsize > 0 and self._qsize() >= self.maxsize:
+                self.dropped += 1
+                dropped = True
+                if self.policy == "drop-newest":
+                    dropped_item = item
+                else:
+                    dropped_item = self._get()
+                    self.unfinished_tasks -= 1  # the dropped item will never be task_done()
+            if not (dropped and self.policy == "drop-newest"):
+                self._put(item)
+                self.unfinished_tasks += 1
+                self.not_empty.notify()
+        # a None sentinel holds nothing to give back
+        if dropped_item is not None and self.on_drop is not None:
+            self.on_drop(dropped_item)
+
+# Default (size, overflow policy) of the queue between each capture stage
+STAGE_QUEUE_DEFAULTS = {
+    "rx":      (256, "block"),        # ft232h -> binary decoder (raw chunks, the backlog has its own drop policy)
+    "stream":  (8,   "drop-newest"),  # binary decoder -> stream decoder (frames)
+    "display": (4,   "drop-oldest"),  # stream decoder -> display (channel groups)
+    "record":  (64,  "block"),        # stream decoder -> headless frame writer
+    "capture": (64,  "drop-newest"),  # stream decoder -> capture writer pool (FrameRecorder)
+}
+
+# Parses the --queue options ("stage:size:policy") on top of the defaults
+def stage_queue_config(queue_options):
+    config = dict(STAGE_QUEUE_DEFAULTS)
+    for option in (queue_options or []):
+        try:
+            stage, size, policy = option.split(":")
+            if stage not in config or policy not in StageQueue.POLICIES:
+                raise ValueError
+            config[stage] = (int(size), policy)
+        except ValueError:
+            raise SystemExit(f"Invalid --queue option '{option}', expected stage:size:policy "
+                             f"with stage in {list(config)} and policy in {list(StageQueue.POLICIES)}")
+    return config
+
+# One line summary of the capture metrics, shown in the status bar.
+# Multi-board captures get one summary per board (see board_prefix).
+# With capture=False only the metrics found in the registry are shown (the
+# display side of a --multiprocess run, whose capture metrics live in the
+# capture process).
+def format_status_line(registry=metrics, capture=True):
+    snapshot = registry.snapshot()
+    def field(name, key, default=0):
+        value = snapshot.get(name)
+        return value.get(key, default) if isinstance(value, dict) else default
+    boards = sorted(name[:-len("decode.frames")] for name in snapshot if name.endswith("decode.frames"))
+    if capture and not boards:
+        boards = [""]
+    parts = []
+    for prefix in boards:
+        label = f"{prefix[:-1]} " if prefix else ""
+        parts += [
+            f"{label}FPS: {field(prefix + 'decode.frames', 'ewma'):.2f}",
+            f"rx {field(prefix + 'rx.bytes', 'rate') / 1e6:.2f}MB/s",
+            f"decode {field(prefix + 'decode.time', 'mean') * 1e3:.2f}ms",
+            f"pool {snapshot.get(prefix + 'pool.available', 0)}/{snapshot.get(prefix + 'pool.size', 0)} "
+            f"exhausted {snapshot.get(prefix + 'pool.exhausted', 0)}",
+            f"resyncs {snapshot.get(prefix + 'framing.resyncs', 0)}",
+        ]
+    if "merge.groups" in snapshot:
+        parts.insert(0, f"merged {field('merge.groups', 'ewma'):.2f}fps dropped {field('merge.dropped', 'total')}")
+    if "display.frames" in snapshot:
+        parts.insert(1, f"display {field('display.frames', 'ewma'):.2f}fps "
+                        f"({field('display.draw_time', 'mean') * 1e3:.2f}ms, skipped {field('display.skipped', 'total')})")
+    if snapshot.get("capture.burst.target"):
+        parts.append(f"burst {snapshot['capture.burst.captured']}/{snapshot['capture.burst.target']} "
+                     f"dropped {snapshot['capture.burst.dropped']} written {snapshot['capture.burst.written']}")
+    if "capture.trigger.buffered" in snapshot:
+        parts.append(f"pretrigger {snapshot['capture.trigger.buffered']} frames, "
+                     f"written {snapshot['capture.trigger.written']} dropped {snapshot['capture.trigger.dropped']}")
+    drops = [f"{name[len('queue.'):-len('.dropped')]}:{value}" for name, value in snapshot.items()
+             if name.startswith("queue.") and name.endswith(".dropped")]
+    if drops:
+        parts.append("drops " + " ".join(drops))
+    return " | ".join(parts)
+
+# Starts writing the metrics to --metrics_file (if given), returns the writer
+def start_metrics_writer(args):
+    if not args.metrics_file:
+        return None
+    writer = MetricsFileWriter(metrics, args.metrics_file, args.metrics_period)
+    writer.start()
+    print(f"Writing metrics to {args.metrics_file} every {args.metrics_period}s")
+    return writer
+
+# Splits the filename of a capture request into (output_dir, base_filename)
+def split_capture_filename(filename):
+    file_path = filename.split("/")
+    if(filename == ""):
+        return "", "default"
+    if(len(file_path) == 1):
+        return file_path[0], "default"
+    return ('/').join(file_path[:-1]), file_path[-1]
+
+# Hand the channels of a decoded frame to the display queue as a single
+# group, a list of (header_info, cropped channel view, frame_buffer) with one
+# package per channel, taking one reference on the frame buffer per package.
+# The group is queued (and dropped) as a whole so the channels drawn together
+# always come from the same frame.
+def publish_channels(display_queue, header_info, frame, frame_buffer, crop):
+    channels = header_info[2]
+    frame_buffer.retain(channels)
+    display_queue.put([(header_info, frame[:, :, c][crop], frame_buffer) for c in range(channels)])
+
 # Form complete channels by seperating out of the streams (frames)
 # do this using the header info, the data does not include the header
 # as it is passed separately as such:
 # ([width, height, channels, data_width], data_np)
 # data is stored as BIG-ENDIAN
 #
+# The stream is unpacked once into a (height, width, channels) frame taken
+# from the frame pool, every channel (and its display crop) is then handed out
+# to the display queue as a view into that frame (see publish_channels):
+# ([width, height, channels, data_width], channel_np, frame_buffer)
+# Consumers must call frame_buffer.release() once they are done with the
+# view. Consumers that need a contiguous array have to make the copy themselves.
+# If a frame_queue is given, the whole frame is also handed to it as
+# ([width, height, channels, data_width], frame_np, frame_buffer)
+# (this is how frames leave the capture process in multiprocess mode).
+#
+# The window is optional, it is only signaled when a new frame is available.
+#
 # Since this is only synchronized place to record frames, the
-# StreamDecoder also has the job of recording frames.
+# StreamDecoder also has the job of recording frames: the frames of a capture
+# request are handed (without copy) to the recorder, a FrameRecorder whose
+# writer threads do the encoding and disk I/O. Requests of several frames are
+# bursts, copied into the RAM reserved by the recorder and written once done.
+# With a pretrigger ring (PretriggerRing), every frame is also kept there and
+# {"trigger": True, ...} requests dump the frames around the trigger.
 #
-# It also has the additional job of recording the fps stats.
+# It also has the additional job of recording the fps and decode time
+# metrics ("decode.frames", "decode.time") as well as the pool metrics.
 class StreamDecoder:
-    def __init__(self, rx_stream_queue, rx_channel_queues, window, recorder_queues, recorder_request_queue, fast=False):
+    def __init__(self, rx_stream_queue, display_queue, window, recorder, recorder_request_queue, fast=False, pool_size=16,
+                 frame_queue=None, pool=None, tracer=None, board="", pretrigger=None):
         self.rx_stream_queue        = rx_stream_queue
-        self.rx_channel_queues      = rx_channel_queues
+        self.display_queue          = display_queue
+        self.frame_queue            = frame_queue
         self.window                 = window
+        self.tracer                 = tracer
         self.fast = fast
+        self.crop = display_crop(fast)
+        self.pool = pool if pool is not None else FramePool(pool_size)
         # Recording related
-        self.recorder_queues = recorder_queues
+        self.recorder = recorder
         self.recorder_request_queue = recorder_request_queue
         self.remaining = 0
         self.several_frames_requested = False
         self.output_dir = ''
         self.base_filename = ''
+        self.record_format = 'png'
+        self.record_separate = True
         self.unique_id = 0
-
-        # Recording FPS stats
-        self.last_time = time.time()
+        self.burst = None
+        self.pretrigger = pretrigger
+
+        # Recording FPS and decode time stats
+        prefix = board_prefix(board)
+        self.frames_meter = metrics.meter(prefix + "decode.frames")
+        self.decode_timer = metrics.timer(prefix + "decode.time")
+        metrics.gauge(prefix + "pool.size", lambda: self.pool.num_buffers)
+        metrics.gauge(prefix + "pool.available", self.pool.available)
+        metrics.gauge(prefix + "pool.exhausted", lambda: self.pool.exhausted)
+
+        # Sample unpacker, cached for the data_width of the last header
+        self.unpacker_data_width = None
+        self.unpacker = None
+        self.sample_dtype = None
         
     def run(self):
         while True:
             rx_stream_pkg = self.rx_stream_queue.get()
+            start = time.perf_counter()
             rx_stream_header_info = rx_stream_pkg[0]
             rx_stream_np          = rx_stream_pkg[1]
+            trace                 = rx_stream_pkg[2] if len(rx_stream_pkg) > 2 else None
+            arrival_time          = rx_stream_pkg[3] if len(rx_stream_pkg) > 3 else time.monotonic()
             width      = rx_stream_header_info[0]
             height     = rx_stream_header_info[1]
             channels   = rx_stream_header_info[2]
@@ -209,320 +994,127 @@ class StreamDecoder:
             except:
                 pass
             try:
-                # first group uint8s into their own items
-                rx_stream_np = rx_stream_np.reshape(-1, data_width // 8)
-                # then combine each bytes parcel into one int using BIG-ENDIAN
-                rx_stream_np = combine_bytes(rx_stream_np, data_width)
-  
-                for c in range(channels):
-                    # splice each channel according to how many channels there 
-                    channel = np.array(rx_stream_np[c::channels], copy=True)
-                    # then reshape into the appropriate width and height
-                    channel = channel.reshape(height, width)
-                    # make continguous array
-                    channel = np.ascontiguousarray(channel)
-                    # are and add it to the rx_channel_queues, with header info too
-                    # threw in a small crop too
-                    # if fast, cropping a 490x450 image:
-                    if self.fast:
-                        self.rx_channel_queues[c].put(
-                            ([width, height, channels, data_width],
-                            channel[0:400, 0:480]))
-                    else:
-                        self.rx_channel_queues[c].put(
-                            ([width, height, channels, data_width],
-                            channel[15:415, 5:485]))
-                    
-                    # If recording is active, we should push it to the 
-                    # recording queues too
+                # combine each parcel of bytes into one sample using BIG-ENDIAN,
+                # written straight into a (height, width, channels) pooled frame
+                unpack = self.get_unpacker(data_width)
+                # a short or long payload (e.g. a corrupted header) is dropped
+                # before it can resize the pool or take a buffer
+                expected_len = width * height * channels * (data_width // 8)
+                if len(rx_stream_np) != expected_len:
+                    raise ValueError(f"payload of {len(rx_stream_np)} bytes, the header says {expected_len}")
+                self.pool.configure((height, width, channels), self.sample_dtype)
+                frame_buffer = self.pool.acquire()
+                if frame_buffer is None:
+                    # every buffer is still held by a consumer, drop this frame
+                    # (counted in pool.exhausted)
+                    continue
+                try:
+                    frame = unpack(rx_stream_np, frame_buffer.array)
+                    frame_buffer.timestamp = arrival_time
+                    header_info = [width, height, channels, data_width]
+                    if trace is not None:
+                        trace.stamp("split")
+                        frame_buffer.trace = trace
+
+                    # each channel is a strided view into the frame, add it's display
+                    # crop to the display queue, with header info too
+                    if self.display_queue is not None:
+                        publish_channels(self.display_queue, header_info, frame, frame_buffer, self.crop)
+                    if self.frame_queue is not None:
+                        frame_buffer.retain()
+                        self.frame_queue.put((header_info, frame, frame_buffer))
+                    if trace is not None:
+                        trace.stamp("enqueued")
+
+                    # Keep the most recent frames for triggered captures
+                    if self.pretrigger is not None:
+                        self.pretrigger.add(header_info, frame, arrival_time)
+
+                    # If recording is active, hand the frame to the recorder
                     if(self.remaining > 0):
-                        self.recorder_queues[c].put(
-                            ([width, height, channels, data_width],
-                             channel))
-                        
-                # Process one group of capture        
-                if(self.remaining > 0):
-                    self.step_record_request([width, height, channels, data_width])
-
-                # calculate FPS stat
-                now = time.time()
-                dt = now - self.last_time
-                self.last_time = now
-                fps = 1.0 / dt if dt > 0 else 0.0
-                fps_str = f"FPS: {fps:.2f}"
+                        self.step_record_request(header_info, frame, frame_buffer)
+                finally:
+                    # the consumers and the recorder hold their own references,
+                    # we are done with the frame (even if it turned out malformed)
+                    frame_buffer.release()
+
+                # update FPS and decode time stats
+                self.frames_meter.mark()
+                self.decode_timer.observe(time.perf_counter() - start)
 
                 # Finally for the window, we have to emit the signal to update the display
-                # and pass the fps stat
-                self.window.new_image_received.emit()
-                self.window.statusBar().showMessage(fps_str)
+                if self.window is not None:
+                    self.window.new_image_received.emit()
                 
             except Exception as e:
                 print(e)
                 print("Malformed Stream Detected!")
 
+    def get_unpacker(self, data_width):
+        if data_width != self.unpacker_data_width:
+            self.sample_dtype, self.unpacker = make_sample_unpacker(data_width)
+            self.unpacker_data_width = data_width
+        return self.unpacker
+
     def setup_record_request(self, req):
         if(req == None): # means a req was previously passed and processing
             return
+        if req.get("trigger"):
+            self.trigger_request(req)
+            return
+        if self.burst is not None:
+            self.finish_burst()  # a new request ends the running burst
         self.remaining = req["frames"]
+        self.record_format = req.get("format", "png")
+        self.record_separate = req.get("seperate_cameras", True)
 
         if(self.remaining < 2):
             self.several_frames_requested = False
         else:
             self.several_frames_requested = True
         
-        file_path = req["filename"].split("/")
-        
-        if(req["filename"] == ""):
-            self.output_dir =  ""
-            self.base_filename = "default"
-        elif(len(file_path) == 1):
-            self.output_dir = file_path[0]
-            self.base_filename = "default"
-        else:
-            self.output_dir = ('/').join(file_path[:-1])
-            self.base_filename = file_path[-1]
+        self.output_dir, self.base_filename = split_capture_filename(req["filename"])
+        # the output directory is created by the recorder writers
+
+        if self.several_frames_requested and self.recorder is not None:
+            self.burst = self.recorder.start_burst(self.remaining, self.output_dir, self.base_filename, self.unique_id,
+                                                   self.record_format, self.record_separate, self.lost_frames)
 
-        os.makedirs(self.output_dir, exist_ok=True)
+    def trigger_request(self, req):
+        if self.pretrigger is None:
+            print("Trigger ignored, the pre-trigger ring is off (see --pretrigger_s)")
+            return
+        output_dir, base = split_capture_filename(req["filename"])
+        self.pretrigger.trigger(output_dir, base)
 
-    def step_record_request(self, header_info):
-        filename = self.output_dir + '/' + self.base_filename 
+    def step_record_request(self, header_info, frame, frame_buffer):
+        if self.burst is not None:
+            if self.burst.add(header_info, frame):
+                self.finish_burst()
+            return
         self.remaining -= 1
+        if self.recorder is None:
+            return
 
         width      = header_info[0]
         height     = header_info[1]
-        channels   = header_info[2]
-        data_width = header_info[3]
-
-        # For now, we save the npy and uint8 converted version
-        for c in range(channels):
-            channel_pkg = self.recorder_queues[c].get()
-            channel_int_np = channel_pkg[1]
-
-            if(self.several_frames_requested):
-                #np.save(filename + "_" + str(c) + "_" + str(width) + "_" + str(height) + "_"  + str(self.remaining) + "_" + str(self.unique_id) + "_int.npy",channel_int_np)
-
-                # uint8 png
-                channel_uint8_np = (channel_int_np >> (data_width - 8)).astype(np.uint8)
-                cv2.imwrite(filename + "_" + str(c) + "_" + str(width) + "_" + str(height) + "_" + str(self.remaining) + "_" + str(self.unique_id) + ".png",channel_uint8_np)
-            else:
-                #np.save(filename + "_" + str(c)  + "_" + str(width) + "_" + str(height) + "_" + str(self.unique_id) + "_int.npy",channel_int_np)
-
-                # uint8 png
-                channel_uint8_np = (channel_int_np >> (data_width - 8)).astype(np.uint8)
-                cv2.imwrite(filename + "_" + str(c) + "_" + str(width) + "_" + str(height) + "_"  + str(self.unique_id) + ".png",channel_uint8_np)
-
-            
+        tag = "_" + str(width) + "_" + str(height)
+        if(self.several_frames_requested):
+            tag += "_" + str(self.remaining)
+        tag += "_" + str(self.unique_id)
+
+        # encoding and writing happen in the recorder writer threads
+        self.recorder.submit(self.output_dir, self.base_filename, tag, header_info, frame, frame_buffer,
+                             self.record_format, self.record_separate)
         self.unique_id += 1
         return
 
-class DataRateStats:
-    def __init__(self, window_ms=1000):
-        """
-        :param window_ms: The time window (in milliseconds) over which to calculate the moving average.
-        """
-        self.window_ms = window_ms
-        self.history = deque()
-        self.total_bytes = 0
-
-    def register_bytes_read(self, num_bytes):
-        """
-        Update internal stats with the number of bytes just read.
-        """
-        now = time.time() * 1000
-        self.history.append((now, num_bytes))
-        self.total_bytes += num_bytes
-
-        # Remove samples older than the time window
-        while self.history and self.history[0][0] < now - self.window_ms:
-            self.history.popleft()
-
-    def get_results(self):
-        """
-        Returns a tuple containing the average number of datas read in the last second
-        and the total number of datas read overall.
-        """
-        # Sum bytes within the current window.
-        bytes_in_window = sum(item[1] for item in self.history)
-
-        # Determine the effective window time.
-        if self.history:
-            effective_window_ms = (time.time() * 1000) - self.history[0][0]
-        else:
-            effective_window_ms = self.window_ms
-
-        # Avoid division by zero.
-        if effective_window_ms > 0:
-            data_rate = (bytes_in_window / (effective_window_ms / 1000.0))
-        else:
-            data_rate = 0.0
-
-        return (data_rate, self.total_bytes)
-    
-# This class displays recieved data in a qt window.
-# Images are passed in through the 'image_queue'; whenever something pushes to the image queue, a
-# redraw should be manually requested through the
-#     window.new_image_received.emit()
-# Signal
-class ImageDisplayWindow(QtWidgets.QMainWindow):
-    new_image_received = QtCore.pyqtSignal()
-    capture_settings: dict = None
-    image_scale: float = 1.0
-    color_map: str = "gray"      # "gray" or "color"
-
-    def __init__(self, maxchannels, image_queue, command_queue, write_command_queue, fast=False, parent=None):
-        """
-        this window reads numpy arrays from image_queue containing images to display.
-        Commands are sent from 'command_queue' to the different interface threads (the ft232
-        reader thread and image decoder thread) in response to user actions.
-        """
-        super().__init__(parent)
-
-        self.image_queue = image_queue
-        self.command_queue = command_queue
-        self.write_command_queue = write_command_queue
-        self.fast = fast
-
-        # Make space for image display
-        self.image_display = QtWidgets.QLabel(self)
-        self.setCentralWidget(self.image_display)
-
-        # Trigger an update image whenever the 'new_image_received' signal is fired.
-        self.new_image_received.connect(self.update_image)
-
-        # Add menus for image capture
-        self._add_menu()
-
-        # Add a status bar for showing frame rate and image stats
-        self.status = QtWidgets.QStatusBar()
-        monospace_font = QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont)
-        self.status.setFont(monospace_font)
-        self.setStatusBar(self.status)
-
-        # Matplotlib windows
-        self.mp_windows = []
-        for c in range(maxchannels):
-            self.mp_windows.append(LiveImageViewer(cmap="gray", vmin=0, vmax=255, title=("Channel "+str(c)), fast=self.fast))
-        plt.show(block=False)
-
-    def update_image(self):
-        # image queue
-        # element : [ [header_info, image_data], [header_info, image_data], [header_info, image_data], ...]
-        while True:
-            try:
-                rx_channel_pkgs = []
-                # there must be at least one channel
-                rx_channel_pkgs.append(self.image_queue[0].get_nowait())
-
-                rx_channel_header_info = rx_channel_pkgs[0][0]
-
-                width      = rx_channel_header_info[0]
-                height     = rx_channel_header_info[1]
-                channels   = rx_channel_header_info[2]
-                data_width = rx_channel_header_info[3]
-
-                for c in range(1, channels):
-                    rx_channel_pkgs.append(self.image_queue[c].get_nowait())
-
-            except queue.Empty:
-                return
-            
-            for c in range(channels):
-                frame = rx_channel_pkgs[c][1]
-                self.mp_windows[c].update_image(frame)
-
-            #plt.pause(0.001)
-
-        
-    def _add_menu(self):
-        # File menu
-        menubar = self.menuBar()
-        file_menu = menubar.addMenu("&File")
-        capture_action = QtWidgets.QAction("Capture", self)
-        capture_action.triggered.connect(self.open_capture_dialog)
-        file_menu.addAction(capture_action)
-
-        # View menu
-        view_menu = menubar.addMenu("&View")
-        view_options_action = QtWidgets.QAction("View Options", self)
-        view_options_action.triggered.connect(self.open_view_options_dialog)
-        view_menu.addAction(view_options_action)
-
-        # Send command menu
-        command_menu = menubar.addMenu("&Command")
-
-        # Send raw command
-        command_action = QtWidgets.QAction("Send Command", self)
-        command_action.triggered.connect(self.open_command_dialog)
-        command_menu.addAction(command_action)
-
-        # Set homography
-        set_camera_0_homography_action = QtWidgets.QAction("Set Camera 0 Homography", self)
-        set_camera_0_homography_action.triggered.connect(lambda: self.open_camera_homography_dialog(0x20))
-        command_menu.addAction(set_camera_0_homography_action)
-        set_camera_1_homography_action = QtWidgets.QAction("Set Camera 1 Homography", self)
-        set_camera_1_homography_action.triggered.connect(lambda: self.open_camera_homography_dialog(0x10))
-        command_menu.addAction(set_camera_1_homography_action)
-
-        # Set ROI
-        roi_action = QtWidgets.QAction("Send Roi", self)
-        roi_action.triggered.connect(self.open_roi_dialog)
-        command_menu.addAction(roi_action)
-
-        # Set DfDD parameters
-        set_params_action = QtWidgets.QAction("Set DfDD Parameters", self)
-        set_params_action.triggered.connect(self.open_dfdd_parameters_dialog)
-        command_menu.addAction(set_params_action)
-
-    def open_capture_dialog(self):
-        dialog = CaptureDialog(settings=self.capture_settings)
-        if dialog.exec_() == QtWidgets.QDialog.Accepted:
-            values = dialog.get_values()
-            self.capture_settings = values
-            print("\nCapture request:", values)
-            if(self.command_queue is None):
-                print("Request ignored, not central channel")
-            else:
-                self.command_queue.put(values)
-
-
-    def open_view_options_dialog(self):
-        dialog = ViewOptionsDialog(current_scale=self.image_scale, current_color=self.color_map, parent=self)
-        if dialog.exec_() == QtWidgets.QDialog.Accepted:
-            values = dialog.get_values()
-            if (values["scale"] is not None):
-                self.image_scale = values["scale"]
-            if (values["colormap"] is not None):
-                self.color_map = values["colormap"]
-
-    def open_command_dialog(self):
-        self.command_widget = CommandWriteWidget()
-        self.command_widget.write_command.connect(self.handle_write_command)
-        self.command_widget.show()
-
-    def open_camera_homography_dialog(self, start_addr=0x10):
-        self.set_camera_homography_widget = HomographyWidget(start_addr=start_addr)
-        self.set_camera_homography_widget.write_command.connect(self.handle_write_command)
-        self.set_camera_homography_widget.show()
-
-    def open_roi_dialog(self):
-        self.roi_widget = RoiSendWidget()
-        self.roi_widget.write_command.connect(self.handle_write_command)
-        self.roi_widget.show()
-
-    def open_dfdd_parameters_dialog(self):
-        self.dfdd_parameters_widget = DfddParametersSendWidget()
-        self.dfdd_parameters_widget.write_command.connect(self.handle_write_command)
-        self.dfdd_parameters_widget.show()
-
-    def handle_write_command(self, values):
-        if (values is not None): 
-            if(self.write_command_queue is None):
-                print("Handle write command ignored, not central channel")
-            else:
-                self.write_command_queue.put(values["bytes"])
-
-    def update_status(self, text):
-        self.status.showMessage(text)
-
-
+    def finish_burst(self):
+        self.recorder.flush_burst(self.burst)
+        self.unique_id += self.burst.captured
+        self.burst = None
+        self.remaining = 0
 
+    # Frames lost before reaching the recorder, for the burst drop count
+    def lost_frames(self):
+        return self.pool.exhausted + getattr(self.rx_stream_queue, "dropped", 0)
@@ -0,0 +1,143 @@
+# Per-frame latency tracing across the capture pipeline.
+#
+# Every frame carries a FrameTrace with monotonic timestamps (time.monotonic,
+# which is shared between processes) taken at each stage:
+#     received  the chunk holding the first byte of the frame was read
+#     framed    the BinaryDecoder cut the complete frame out of the stream
+#     split     the StreamDecoder unpacked the frame into its channels
+#     enqueued  the channels were handed to the display queues
+#     drawn     the display drew the frame (or "written" when headless)
+# When a frame is finished, the time spent in each stage goes into rolling
+# windows from which p50/p95/p99 latencies are computed, and the trace can be
+# appended (one JSON object per line) to a dump file for offline analysis.
+#
+# Tracing is off when no tracer is given to the pipeline (tracer is None),
+# which costs one 'is None' check per stage.
+
+import collections
+import json
+import threading
+import time
+import numpy as np
+
+TRACE_STAGES = ("received", "framed", "split", "enqueued", "drawn", "written")
+
+class FrameTrace:
+    __slots__ = ("frame_id", "stamps")
+
+    def __init__(self, frame_id):
+        self.frame_id = frame_id
+        self.stamps   = {}
+
+    def stamp(self, stage, t=None):
+        self.stamps[stage] = time.monotonic() if t is None else t
+
+class LatencyTracer:
+    def __init__(self, window=1000, dump_path=None, print_period=5):
+        """
+        :param window: number of frames kept to compute the latency percentiles.
+        :param dump_path: if given, every finished trace is appended to this file.
+        :param print_period: seconds between latency summaries on stdout (0 disables them).
+        """
+        self.window       = window
+        self.print_period = print_period
+        self.lock         = threading.Lock()
+        self.next_id      = 0
+        self.latencies    = {}  # stage -> deque of seconds spent getting to that stage
+        self.dump_file    = open(dump_path, "a") if dump_path else None
+        self.last_printed_time = time.monotonic()
+
+        # receive time of chunks not yet taken by the decoder, by id(chunk)
+        self.pending_chunks = collections.OrderedDict()
+        # (end offset in the stream, receive time) of the latest decoded chunks,
+        # per stream (one stream per board)
+        self.chunk_times = collections.defaultdict(lambda: collections.deque(maxlen=4096))
+
+    # ---------- chunk receipt ----------
+    def chunk_received(self, chunk):
+        """
+        Called by the source right before putting chunk on the rx_binary_queue.
+        """
+        with self.lock:
+            self.pending_chunks[id(chunk)] = time.monotonic()
+            if len(self.pending_chunks) > 4096:
+                self.pending_chunks.popitem(last=False)
+
+    def chunk_decoded(self, chunk, end_offset, stream=""):
+        """
+        Called by the decoder when chunk was appended to its stream, end_offset
+        being the stream offset right after the chunk.
+        """
+        with self.lock:
+            t = self.pending_chunks.pop(id(chunk), None)
+            chunk_times = self.chunk_times[stream]
+        chunk_times.append((end_offset, time.monotonic() if t is None else t))
+
+    def new_trace(self, stream_offset, stream=""):
+        """
+        Starts the trace of a frame whose first byte sits at stream_offset.
+        """
+        with self.lock:
+            trace = FrameTrace(self.next_id)
+            self.next_id += 1
+            chunk_times = self.chunk_times[stream]
+        received = None
+        for end_offset, t in chunk_times:
+            if end_offset > stream_offset:
+                received = t
+                break
+        trace.stamp("received", received)
+        return trace
+
+    # ---------- statistics ----------
+    def finish(self, trace, stage="drawn"):
+        """
+        Stamps the final stage of a trace and accounts for it.
+        """
+        if trace is None:
+            return
+        trace.stamp(stage)
+        stamps = trace.stamps
+        with self.lock:
+            previous = None
+            for name in TRACE_STAGES:
+                if name not in stamps:
+                    continue
+                if previous is not None:
+                    self._add(name, stamps[name] - stamps[previous])
+                previous = name
+            self._add("total", stamps[stage] - stamps["received"])
+            if self.dump_file is not None:
+                self.dump_file.write(json.dumps({"frame": trace.frame_id, **stamps}) + "\n")
+
+        now = time.monotonic()
+        if self.print_period > 0 and (now - self.last_printed_time) > self.print_period:
+            print("Latency: " + self.format_summary())
+            if self.dump_file is not None:
+                self.dump_file.flush()
+            self.last_printed_time = now
+
+    def percentiles(self):
+        """
+        Returns {stage: (p50, p95, p99)} in seconds over the rolling window.
+        """
+        with self.lock:
+            samples = {stage: np.array(values) for stage, values in self.latencies.items() if values}
+        return {stage: tuple(np.percentile(values, (50, 95, 99))) for stage, values in samples.items()}
+
+    def format_summary(self):
+        return " | ".join(f"{stage} p50/p95/p99 {p50*1e3:.1f}/{p95*1e3:.1f}/{p99*1e3:.1f}ms"
+                          for stage, (p50, p95, p99) in self.percentiles().items())
+
+    def _add(self, stage, seconds):
+        values = self.latencies.get(stage)
+        if values is None:
+            values = collections.deque(maxlen=self.window)
+            self.latencies[stage] = values
+        values.append(seconds)
+
+# Returns the tracer selected by the command line arguments, None when off
+def make_tracer(args):
+    if not (args.trace or args.trace_dump):
+        return None
+    return LatencyTracer(args.trace_window, args.trace_dump)
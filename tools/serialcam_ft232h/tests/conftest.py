@@ -0,0 +1,6 @@
+# The serialcam modules import each other by their bare names (they are run
+# as scripts from their own directory), make them importable from the tests.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from serialcam_stream_utils_ft232h import BinaryDecoder
+
+MAGIC = b"BIVFRAME"
+W, H, C, DW = 16, 8, 2, 16
+
+
+def frame(value, width=W, height=H):
+    payload = np.full(width * height * C, value, dtype=">u2").tobytes()
+    return MAGIC + bytes([width >> 8, width & 255, height >> 8, height & 255, C, DW]) + payload
+
+
+class ListQueue(list):
+    def put(self, item, *args, **kwargs):
+        self.append(item)
+
+
+def make_decoder(framing, max_backlog=1 << 20):
+    out = ListQueue()
+    return BinaryDecoder(None, out, MAGIC, max_backlog, framing), out
+
+
+def feed(decoder, data, chunk_size=100):
+    for offset in range(0, len(data), chunk_size):
+        if decoder.acc.append(data[offset:offset + chunk_size]) > 0:
+            decoder.lose_sync()
+        decoder.extract_frames()
+
+
+def values(out):
+    return [int(np.frombuffer(stream[:2].tobytes(), ">u2")[0]) for _, stream, _, _ in out]
+
+
+@pytest.mark.parametrize("framing", ["header", "marker"])
+@pytest.mark.parametrize("chunk_size", [1, 7, 100, 5000])
+def test_frames_split_across_chunks(framing, chunk_size):
+    decoder, out = make_decoder(framing)
+    feed(decoder, b"".join(frame(i) for i in range(5)) + MAGIC, chunk_size)
+    assert values(out) == [0, 1, 2, 3, 4]
+    assert all(header == [W, H, C, DW] for header, _, _, _ in out)
+    assert all(len(stream) == W * H * C * 2 for _, stream, _, _ in out)
+    assert decoder.resyncs == 0
+
+
+def test_header_framing_sends_a_frame_without_waiting_for_the_next_one():
+    decoder, out = make_decoder("header")
+    feed(decoder, frame(7))
+    assert values(out) == [7]
+
+
+def test_marker_framing_waits_for_the_next_magic_bytes():
+    decoder, out = make_decoder("marker")
+    feed(decoder, frame(7))
+    assert out == []
+    feed(decoder, MAGIC)
+    assert values(out) == [7]
+
+
+@pytest.mark.parametrize("framing", ["header", "marker"])
+def test_garbage_before_the_first_frame_is_skipped(framing):
+    decoder, out = make_decoder(framing)
+    feed(decoder, b"\x00garbage BIVFRAM" + frame(1) + frame(2) + MAGIC)
+    assert values(out) == [1, 2]
+
+
+def test_header_framing_resyncs_when_the_magic_bytes_are_missing():
+    decoder, out = make_decoder("header")
+    truncated = frame(1)[:200]
+    feed(decoder, frame(0) + truncated + frame(2) + frame(3) + frame(4))
+    # frame 1 swallows the start of frame 2, the check at the next header catches it
+    assert values(out)[0] == 0
+    assert values(out)[-2:] == [3, 4]
+    assert decoder.resyncs == 1
+
+
+def test_header_framing_rejects_an_impossible_payload_length():
+    decoder, out = make_decoder("header", max_backlog=4096)
+    bad = bytearray(frame(1))
+    bad[8:10] = b"\xff\xff"  # width 65535, larger than the backlog
+    feed(decoder, frame(0) + bytes(bad) + frame(2) + frame(3))
+    assert values(out) == [0, 2, 3]
+
+
+@pytest.mark.parametrize("framing", ["header", "marker"])
+def test_backlog_overflow_forgets_the_frame_in_progress(framing):
+    frame_len = len(frame(0))
+    decoder, out = make_decoder(framing, max_backlog=frame_len + 100)
+    # half a frame then a chunk that overflows the backlog: the frame in
+    # progress loses its start and must not be sent
+    decoder.acc.append(frame(0)[:frame_len // 2])
+    decoder.extract_frames()
+    feed(decoder, frame(0)[frame_len // 2:] + frame(1) + frame(2) + MAGIC, chunk_size=frame_len)
+    assert decoder.acc.dropped_bytes > 0
+    # only whole frames, never one made of the pieces around the gap
+    for _, stream, _, _ in out:
+        assert len(stream) == W * H * C * 2
+        samples = np.frombuffer(stream.tobytes(), ">u2")
+        assert (samples == samples[0]).all()
+    assert values(out)[-1] == 2
@@ -0,0 +1,64 @@
+import numpy as np
+
+from serialcam_stream_utils_ft232h import ByteAccumulator
+
+
+def test_append_view_consume():
+    acc = ByteAccumulator(initial_size=8, max_size=64)
+    assert acc.append(b"abcdef") == 0
+    assert len(acc) == 6
+    assert acc.view().tobytes() == b"abcdef"
+    acc.consume(2)
+    assert acc.view().tobytes() == b"cdef"
+    assert acc.stream_offset() == 2
+    acc.consume(10)
+    assert len(acc) == 0 and acc.start == acc.end == 0
+
+
+def test_grows_and_compacts_without_losing_bytes():
+    acc = ByteAccumulator(initial_size=4, max_size=1024)
+    expected = b""
+    for i in range(50):
+        chunk = bytes([i]) * (i % 7 + 1)
+        acc.append(chunk)
+        expected += chunk
+        if i % 3 == 0:
+            acc.consume(2)
+            expected = expected[2:]
+        assert acc.view().tobytes() == expected
+    assert len(acc.buf) <= 1024
+    assert acc.total_appended - len(acc) == acc.stream_offset()
+
+
+def test_overflow_drops_oldest_bytes():
+    acc = ByteAccumulator(initial_size=8, max_size=10)
+    acc.append(b"0123456")
+    assert acc.append(b"789ab") == 2
+    assert acc.view().tobytes() == b"23456789ab"
+    assert acc.dropped_bytes == 2
+    assert acc.stream_offset() == 2
+
+
+def test_chunk_larger_than_max_size_keeps_its_newest_bytes():
+    acc = ByteAccumulator(initial_size=8, max_size=8)
+    acc.append(b"xyz")
+    assert acc.append(b"0123456789") == 3 + 2
+    assert acc.view().tobytes() == b"23456789"
+    assert acc.stream_offset() == 5
+
+
+def test_find_and_peek_are_relative_to_the_read_cursor():
+    acc = ByteAccumulator(initial_size=16, max_size=64)
+    acc.append(b"..MAGIC..MAGIC")
+    acc.consume(1)
+    assert acc.find(b"MAGIC") == 1
+    assert acc.find(b"MAGIC", 2) == 8
+    assert acc.find(b"NOPE") == -1
+    assert acc.peek(1, 5) == b"MAGIC"
+
+
+def test_view_is_uint8():
+    acc = ByteAccumulator()
+    acc.append(bytes(range(10)))
+    assert acc.view().dtype == np.uint8
+    assert list(acc.view()[:3]) == [0, 1, 2]
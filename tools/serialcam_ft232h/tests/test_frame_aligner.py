@@ -0,0 +1,54 @@
+import numpy as np
+
+from serialcam_stream_utils_ft232h import FramePool
+from serialcam_multiboard_ft232h import FrameAligner
+
+
+def make_boards(n=2, buffers=8):
+    pools = []
+    for _ in range(n):
+        pool = FramePool(buffers)
+        pool.configure((2, 2, 1), np.uint16)
+        pools.append(pool)
+    return pools
+
+
+def package(pool, timestamp):
+    frame_buffer = pool.acquire()
+    frame_buffer.timestamp = timestamp
+    return ([2, 2, 1, 16], frame_buffer.array, frame_buffer)
+
+
+def test_groups_frames_arriving_within_the_tolerance():
+    pools = make_boards()
+    groups = []
+    aligner = FrameAligner(None, pools, lambda group: groups.append([pkg[2].timestamp for pkg in group]), 0.005)
+    aligner.add(package(pools[0], 1.000))
+    aligner.add(package(pools[1], 1.003))
+    aligner.add(package(pools[1], 1.033))
+    aligner.add(package(pools[0], 1.031))
+    assert groups == [[1.000, 1.003], [1.031, 1.033]]
+    # the aligner released every grouped frame
+    assert [pool.available() for pool in pools] == [8, 8]
+
+
+def test_drops_frames_without_a_match():
+    pools = make_boards()
+    groups = []
+    aligner = FrameAligner(None, pools, groups.append, 0.005)
+    aligner.add(package(pools[0], 1.000))
+    aligner.add(package(pools[1], 1.020))  # board 0 missed this frame
+    aligner.add(package(pools[0], 1.021))
+    assert len(groups) == 1
+    assert [pkg[2].timestamp for pkg in groups[0]] == [1.021, 1.020]
+    assert aligner.dropped.total >= 1
+    assert [pool.available() for pool in pools] == [8, 8]
+
+
+def test_a_silent_board_only_keeps_max_pending_frames():
+    pools = make_boards()
+    aligner = FrameAligner(None, pools, lambda group: None, 0.005, max_pending=2)
+    for i in range(5):
+        aligner.add(package(pools[0], float(i)))
+    assert len(aligner.pending[0]) == 2
+    assert pools[0].available() == 8 - 2
@@ -0,0 +1,74 @@
+import numpy as np
+
+from serialcam_stream_utils_ft232h import FramePool, StageQueue, publish_channels, release_group
+
+
+def test_acquire_until_exhausted():
+    pool = FramePool(2)
+    pool.configure((4, 5, 2), np.uint16)
+    a, b = pool.acquire(), pool.acquire()
+    assert a is not b and a.array.shape == (4, 5, 2)
+    assert pool.acquire() is None
+    assert pool.exhausted == 1
+    a.release()
+    assert pool.available() == 1
+    assert pool.acquire() is a
+
+
+def test_buffer_comes_back_after_the_last_release():
+    pool = FramePool(1)
+    pool.configure((2, 2, 1), np.uint8)
+    frame = pool.acquire()
+    frame.retain(2)
+    frame.release()
+    frame.release()
+    assert pool.available() == 0
+    frame.release()
+    assert pool.available() == 1
+
+
+def test_new_shape_drops_the_old_generation():
+    pool = FramePool(2)
+    pool.configure((2, 2, 1), np.uint8)
+    old = pool.acquire()
+    pool.configure((3, 3, 1), np.uint16)
+    assert pool.available() == 2
+    old.release()
+    assert pool.available() == 2
+    assert all(frame.array.shape == (3, 3, 1) for frame in pool.free)
+    # same shape again: nothing reallocated
+    free = list(pool.free)
+    pool.configure((3, 3, 1), np.uint16)
+    assert pool.free == free
+
+
+def test_published_channels_hold_one_reference_each():
+    pool = FramePool(2)
+    pool.configure((4, 5, 3), np.uint16)
+    frame_buffer = pool.acquire()
+    frame_buffer.array[...] = np.arange(3)
+    display_queue = StageQueue(1, "drop-oldest", on_drop=release_group)
+    crop = (slice(0, 4), slice(0, 5))
+    publish_channels(display_queue, [5, 4, 3, 16], frame_buffer.array, frame_buffer, crop)
+    frame_buffer.release()
+    group = display_queue.get_nowait()
+    assert [int(pkg[1][0, 0]) for pkg in group] == [0, 1, 2]
+    assert all(pkg[2] is frame_buffer for pkg in group)
+    assert pool.available() == 1
+    release_group(group)
+    assert pool.available() == 2
+
+
+def test_dropped_groups_give_their_buffers_back():
+    pool = FramePool(4)
+    pool.configure((2, 2, 2), np.uint8)
+    display_queue = StageQueue(1, "drop-oldest", on_drop=release_group)
+    crop = (slice(0, 2), slice(0, 2))
+    for _ in range(3):
+        frame_buffer = pool.acquire()
+        publish_channels(display_queue, [2, 2, 2, 8], frame_buffer.array, frame_buffer, crop)
+        frame_buffer.release()
+    assert display_queue.dropped == 2
+    assert pool.available() == 3
+    release_group(display_queue.get_nowait())
+    assert pool.available() == 4
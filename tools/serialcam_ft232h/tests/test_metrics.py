@@ -0,0 +1,50 @@
+import threading
+
+import pytest
+
+from serialcam_metrics_ft232h import RollingWindow, EwmaRate, Meter, MetricsRegistry
+
+
+def test_rolling_window_rate_and_mean():
+    window = RollingWindow(1.0)
+    for i in range(10):
+        window.add(2, now=10.0 + i * 0.1)
+    assert window.rate(now=10.9) == pytest.approx(20 / 0.9)
+    assert window.mean(now=10.9) == 2
+    # every sample expired
+    assert window.rate(now=20.0) == 0.0
+    assert window.mean(now=20.0) == 0.0
+
+
+def test_ewma_converges_then_decays_when_read():
+    ewma = EwmaRate(tau_s=1.0)
+    for i in range(200):
+        ewma.update(1, now=i * 0.1)
+    assert ewma.value(now=19.9) == pytest.approx(10, rel=0.01)
+    assert ewma.value(now=29.9) < 0.01
+    # reading does not change the state
+    assert ewma.value(now=19.9) == pytest.approx(10, rel=0.01)
+
+
+def test_meter_total_is_exact_with_several_threads():
+    meter = Meter()
+    def mark():
+        for _ in range(20000):
+            meter.mark()
+    threads = [threading.Thread(target=mark) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert meter.snapshot()["total"] == 80000
+
+
+def test_registry_returns_the_same_metric_and_calls_gauges():
+    registry = MetricsRegistry()
+    assert registry.meter("a.frames") is registry.meter("a.frames")
+    registry.counter("a.count").inc(3)
+    registry.gauge("a.depth", lambda: 7)
+    snapshot = registry.snapshot()
+    assert snapshot["a.count"] == 3
+    assert snapshot["a.depth"] == 7
+    assert set(snapshot["a.frames"]) == {"total", "rate", "ewma"}
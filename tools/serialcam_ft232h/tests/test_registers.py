@@ -0,0 +1,67 @@
+import queue
+
+from serialcam_registers_ft232h import ShadowRegisterFile, COMMAND_PACKET
+from serialcam_stream_utils_ft232h import TxScheduler
+
+
+def packets(*writes):
+    return b"".join(COMMAND_PACKET.pack(value, addr) for value, addr in writes)
+
+
+def writes(data):
+    return list(COMMAND_PACKET.iter_unpack(data))
+
+
+def test_unchanged_values_are_suppressed():
+    registers = ShadowRegisterFile()
+    assert writes(registers.filter_writes(packets((1, 0x00), (2, 0x01)))) == [(1, 0x00), (2, 0x01)]
+    assert registers.filter_writes(packets((1, 0x00), (2, 0x01))) == b""
+    assert writes(registers.filter_writes(packets((1, 0x00), (3, 0x01)))) == [(3, 0x01)]
+
+
+def test_unmapped_addresses_and_partial_packets_pass_through():
+    registers = ShadowRegisterFile()
+    data = packets((5, 0x40)) + b"\x01\x02"
+    assert registers.filter_writes(data) == data
+    assert registers.filter_writes(data) == data
+    assert len(registers) == 0
+
+
+def test_replay_all_and_forget():
+    registers = ShadowRegisterFile()
+    registers.filter_writes(packets((9, 0x21), (8, 0x20)))
+    assert writes(registers.replay_all()) == [(8, 0x20), (9, 0x21)]
+    registers.forget()
+    assert registers.replay_all() == b""
+    assert writes(registers.filter_writes(packets((8, 0x20)))) == [(8, 0x20)]
+
+
+class StallingDevice:
+    def __init__(self, budget):
+        self.budget  = budget
+        self.written = b""
+
+    def write(self, data):
+        n = min(len(data), self.budget)
+        self.budget -= n
+        self.written += data[:n]
+        return n
+
+
+def test_values_not_written_by_the_tx_thread_are_sent_again():
+    unsent = queue.Queue()
+    registers = ShadowRegisterFile(unsent_queue=unsent)
+    device = StallingDevice(budget=9)  # a packet and a half
+    tx = TxScheduler(device, queue.Queue(), unsent_queue=unsent)
+    tx.send(registers.filter_writes(packets((1, 0x00), (2, 0x01), (3, 0x02))), 3)
+    assert tx.stalls.value >= 1
+    assert writes(registers.filter_writes(packets((1, 0x00), (2, 0x01), (3, 0x02)))) == [(2, 0x01), (3, 0x02)]
+
+
+def test_unsent_values_overwritten_since_are_kept():
+    unsent = queue.Queue()
+    registers = ShadowRegisterFile(unsent_queue=unsent)
+    registers.filter_writes(packets((1, 0x00)))
+    registers.filter_writes(packets((2, 0x00)))
+    unsent.put(packets((1, 0x00)))
+    assert registers.filter_writes(packets((2, 0x00))) == b""
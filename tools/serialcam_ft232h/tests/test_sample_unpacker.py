@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from serialcam_stream_utils_ft232h import make_sample_unpacker
+
+
+def big_endian_bytes(samples, nbytes):
+    return np.frombuffer(b"".join(int(s).to_bytes(nbytes, "big") for s in samples), dtype=np.uint8)
+
+
+@pytest.mark.parametrize("data_width", [8, 16, 24, 32, 40, 48, 56, 64])
+def test_unpacks_big_endian_samples(data_width):
+    nbytes = data_width // 8
+    rng = np.random.default_rng(data_width)
+    samples = [int(rng.integers(0, 1 << 62)) % (1 << data_width) for _ in range(12)]
+    samples[0] = (1 << data_width) - 1  # all bits set
+    dtype, unpack = make_sample_unpacker(data_width)
+    assert dtype.itemsize >= nbytes and dtype.kind == "u"
+    out = np.empty((3, 2, 2), dtype=dtype)
+    result = unpack(big_endian_bytes(samples, nbytes), out)
+    assert result is out
+    assert [int(v) for v in out.reshape(-1)] == samples
+
+
+@pytest.mark.parametrize("data_width", [0, -8, 12, 72])
+def test_rejects_unsupported_widths(data_width):
+    with pytest.raises(ValueError):
+        make_sample_unpacker(data_width)
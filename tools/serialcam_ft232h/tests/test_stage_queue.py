@@ -0,0 +1,74 @@
+import queue
+import threading
+
+import pytest
+
+from serialcam_stream_utils_ft232h import StageQueue, STAGE_QUEUE_DEFAULTS, stage_queue_config
+
+
+def test_drop_oldest_keeps_the_newest_items():
+    dropped = []
+    q = StageQueue(2, "drop-oldest", on_drop=dropped.append)
+    for i in range(5):
+        q.put(i)
+    assert list(q.queue) == [3, 4]
+    assert dropped == [0, 1, 2]
+    assert q.dropped == 3
+
+
+def test_drop_newest_keeps_the_oldest_items():
+    dropped = []
+    q = StageQueue(2, "drop-newest", on_drop=dropped.append)
+    for i in range(5):
+        q.put(i)
+    assert list(q.queue) == [0, 1]
+    assert dropped == [2, 3, 4]
+    assert q.dropped == 3
+
+
+def test_block_waits_for_room():
+    q = StageQueue(1, "block")
+    q.put(0)
+    with pytest.raises(queue.Full):
+        q.put(1, timeout=0.01)
+    assert q.dropped == 0
+
+
+@pytest.mark.parametrize("policy", ["drop-oldest", "drop-newest"])
+def test_none_is_queued_like_any_item(policy):
+    q = StageQueue(2, policy)
+    q.put(None)
+    assert q.qsize() == 1
+    assert q.get_nowait() is None
+
+
+@pytest.mark.parametrize("policy", ["drop-oldest", "drop-newest"])
+def test_join_returns_after_drops(policy):
+    q = StageQueue(2, policy)
+    for i in range(5):
+        q.put(i)
+    while not q.empty():
+        q.get()
+        q.task_done()
+    joined = threading.Event()
+    threading.Thread(target=lambda: (q.join(), joined.set()), daemon=True).start()
+    assert joined.wait(1.0)
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        StageQueue(2, "drop-random")
+
+
+def test_stage_queue_config():
+    config = stage_queue_config(["display:2:drop-newest", "rx:16:drop-oldest"])
+    assert config["display"] == (2, "drop-newest")
+    assert config["rx"] == (16, "drop-oldest")
+    assert config["record"] == STAGE_QUEUE_DEFAULTS["record"]
+    assert stage_queue_config(None) == STAGE_QUEUE_DEFAULTS
+
+
+@pytest.mark.parametrize("option", ["display:2", "nope:2:block", "display:x:block", "display:2:sometimes"])
+def test_stage_queue_config_rejects_bad_options(option):
+    with pytest.raises(SystemExit):
+        stage_queue_config([option])